@@ -23,12 +23,15 @@ import math
 import random
 import time
 import socket
-import select
+import selectors
 import json
 import threading
 import glob
 import os
 from collections import deque
+from itertools import islice
+try: import orjson # Optional: faster save/config files and network messages, falls back to stdlib json
+except ImportError: orjson = None
 
 # --- Constants ---
 # Screen & UI
@@ -47,9 +50,15 @@ MAIN_MENU_MUSIC_FILE = 'main_menu.mp3'
 GAME_MUSIC_FILES_PATTERN = 'in_game*.mp3'
 MUSIC_END_EVENT = pygame.USEREVENT + 1
 MUSIC_FADE_MS = 500
+MUSIC_STOPPED, MUSIC_PLAYING, MUSIC_PAUSED = 0, 1, 2 # Game music player states (tracked locally, not polled from the mixer)
 DEFAULT_MUSIC_VOLUME = 0.6 # Volume from 0.0 to 1.0
 
 #UI
+TEXT_SURFACE_CACHE_MAX = 256 # Memoized text surfaces kept before the cache is reset
+MENU_EVENT_TYPES = frozenset((pygame.MOUSEBUTTONDOWN, pygame.KEYDOWN)) # The only event types menus and prompts consume
+# Every event type any handler reads; SDL drops the rest before they reach the queue (see main).
+# TEXTINPUT and KEYUP must stay: SDL2 fills KEYDOWN.unicode (settings text fields) from them.
+QUEUED_EVENT_TYPES = [pygame.QUIT, pygame.KEYDOWN, pygame.KEYUP, pygame.TEXTINPUT, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEMOTION, MUSIC_END_EVENT]
 CONFIG_FILENAME = "config.json"
 SAVE_FILENAME_SP = "save_sp.json"
 SAVE_FILENAME_HOST = "save_host.json"
@@ -145,6 +154,7 @@ ENEMY_ATTACK_COOLDOWN = 0.9
 WAVE_DURATION = 40
 WAVE_COOLDOWN = 30
 MAX_WAVES = 20
+SPATIAL_HASH_CELL_SIZE = TILE_SIZE * 4 # Bucket size for enemy neighbor queries (turret targeting)
 
 # Building Stats & Upgrades
 MAX_TIER = 3
@@ -207,7 +217,23 @@ DEFAULT_NETWORK_UPDATE_INTERVAL = 0.05 # Default value (20 Hz)
 MIN_NETWORK_UPDATE_INTERVAL = 0.01   # Limit (100 Hz)
 MAX_NETWORK_UPDATE_INTERVAL = 0.2    # Limit (5 Hz)
 BUFFER_SIZE = 4096
+RECV_CHUNK_SIZE = BUFFER_SIZE * 16 # Bytes requested per recv; snapshots span many of these
 HEADER_LENGTH = 10
+# Shared wire encoder: compact separators (no padding spaces) and no circular-reference bookkeeping
+JSON_WIRE_ENCODER = json.JSONEncoder(separators=(',', ':'), check_circular=False)
+SOCKET_HAS_SENDMSG = hasattr(socket.socket, 'sendmsg') # Vectored send (POSIX); Windows falls back to send
+SEND_IOV_MAX = 64 # Max queued buffers handed to one sendmsg call
+SEND_QUEUE_HIGH_WATER = 4 * 1024 * 1024 # Bytes queued for one client before it is dropped as a slow consumer
+SNAPSHOT_ENTITY_SECTIONS = ('players', 'structures', 'enemies', 'projectiles') # Keyed by id; diffed per entity in deltas
+DELTA_MAX_CHANGED_RATIO = 0.6 # Send a full state_update instead of a delta when more than this share of entities changed
+SOCKET_SNDBUF_SIZE = 256 * 1024 # Kernel send buffer requested for game connections (fewer full-buffer stalls on snapshots)
+# Pre-encoded JSON around the only varying field (an int id) of fixed-shape server messages, see encode_id_message
+ASSIGN_ID_TEMPLATE = (b'{"type":"assign_id","data":{"id":', b'}}')
+PLAYER_LEAVE_TEMPLATE = (b'{"type":"player_leave","player_id":', b'}')
+STATE_KEYFRAME_INTERVAL = 20 # Every Nth state broadcast is a full snapshot, so a client that missed a delta resyncs
+SNAPSHOT_FLOAT_DECIMALS = 2 # Positions/velocities/angles are rounded in snapshots (0.01 px): shorter JSON, fewer spurious deltas
+FULL_STATE_MESSAGE_TYPES = frozenset(('initial_state', 'state_update')) # Messages the client applies with apply_full_snapshot
+STATE_HISTORY_SIZE = 32 # Recent broadcast/initial snapshots kept by id as delta baselines
 
 # --- Global Fonts (initialized later) ---
 font_tiny = None
@@ -215,6 +241,7 @@ font_small = None
 font_medium = None
 font_large = None
 font_title = None
+_text_surface_cache = {} # (text, size, color) -> Surface, see get_text_surface
 
 # --- Helper Functions ---
 def init_fonts():
@@ -235,8 +262,8 @@ def init_fonts():
         if not font_large: font_large = pygame.font.Font(None, 72)
         if not font_title: font_title = pygame.font.Font(None, 80)
 
-def draw_text(surface, text, size, x, y, color=COLOR_WHITE, align="topleft"):
-    """Draws text on a surface using globally loaded fonts."""
+def font_for_size(size):
+    """Returns the globally loaded font closest to the requested size."""
     font = None
     try:
         if size <= 16:
@@ -254,8 +281,32 @@ def draw_text(surface, text, size, x, y, color=COLOR_WHITE, align="topleft"):
             font = pygame.font.Font(None, int(size))
             print(f"WARN: Using fallback font for size {size}.")
     except Exception as e:
-        print(f"FONT ERR: {e}. Size:{size}, Text:{text}")
+        print(f"FONT ERR: {e}. Size:{size}")
         font = pygame.font.Font(None, int(size))
+    return font
+
+def render_text(text, size, color=COLOR_WHITE):
+    """Renders text once into a surface that callers can cache and blit every frame."""
+    return font_for_size(size).render(text, True, color)
+
+def get_text_surface(text, size, color=COLOR_WHITE):
+    """Returns a rendered text surface, memoized by (text, size, color) for labels drawn every frame."""
+    key = (text, size, color)
+    text_surface = _text_surface_cache.get(key)
+    if text_surface is None:
+        if len(_text_surface_cache) >= TEXT_SURFACE_CACHE_MAX: _text_surface_cache.clear() # Bound it if callers pass changing text
+        text_surface = _text_surface_cache[key] = render_text(text, size, color)
+    return text_surface
+
+def draw_cached_text(surface, text, size, x, y, color=COLOR_WHITE, align="topleft"):
+    """Like draw_text, but blits a memoized surface (see get_text_surface) instead of rendering again."""
+    text_surface = get_text_surface(text, size, color)
+    text_rect = text_surface.get_rect(); setattr(text_rect, align, (x, y))
+    surface.blit(text_surface, text_rect)
+
+def draw_text(surface, text, size, x, y, color=COLOR_WHITE, align="topleft"):
+    """Draws text on a surface using globally loaded fonts."""
+    font = font_for_size(size)
 
     try:
         text_surface = font.render(text, True, color)
@@ -265,6 +316,18 @@ def draw_text(surface, text, size, x, y, color=COLOR_WHITE, align="topleft"):
     except Exception as e:
          print(f"TEXT RENDER ERR: {e}. Size:{size}, Text:{text}, Color:{color}")
 
+def button_bounds(rect):
+    """Unpacks a button rect into (x0, y0, x1, y1) for button_at's plain comparisons."""
+    return (rect.left, rect.top, rect.right, rect.bottom)
+
+def button_at(buttons, pos):
+    """Returns the first button dict whose precomputed 'bounds' contain pos, or None."""
+    mx, my = pos
+    for btn in buttons:
+        x0, y0, x1, y1 = btn['bounds']
+        if x0 <= mx < x1 and y0 <= my < y1: return btn
+    return None
+
 def world_to_grid(x, y):
     return int(x // TILE_SIZE), int(y // TILE_SIZE)
 
@@ -283,12 +346,25 @@ def distance(x1, y1, x2, y2):
     return math.sqrt(distance_sq(x1, y1, x2, y2)) + 1e-9
 
 # --- Network Helper Functions ---
+# Wire codec: compact JSON either way (orjson's output is plain JSON), so peers with and without orjson interoperate
+if orjson is not None:
+    def wire_dumps(data): return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS) # int dict keys become strings, as with json
+    wire_loads = orjson.loads
+else:
+    def wire_dumps(data): return JSON_WIRE_ENCODER.encode(data).encode('utf-8')
+    wire_loads = json.loads
+
 def encode_message(data):
     """Encodes a dictionary to JSON bytes with a header."""
+    parts = encode_message_parts(data)
+    return parts[0] + parts[1] if parts else None
+
+def encode_message_parts(data):
+    """Encodes a dictionary to a (header, body) bytes pair, for vectored sends without joining them."""
     try:
-        message = json.dumps(data).encode('utf-8')
+        message = wire_dumps(data) # orjson's JSONEncodeError is a TypeError too
         header = f"{len(message):<{HEADER_LENGTH}}".encode('utf-8')
-        return header + message
+        return header, message
     except TypeError as e:
         print(f"Error encoding message: {e}, Data causing error: {data}")
         if isinstance(data, dict):
@@ -303,42 +379,72 @@ def encode_message(data):
         print(f"Unexpected error encoding message: {e}, Data: {data}")
         return None
 
-def receive_message(sock):
-    """Receives a complete message based on the header length."""
-    try:
-        header_data = sock.recv(HEADER_LENGTH)
-        if not header_data:
-            return None # Connection closed
-        message_length = int(header_data.decode('utf-8').strip())
-
-        chunks = []
-        bytes_recd = 0
-        while bytes_recd < message_length:
-            chunk = sock.recv(min(message_length - bytes_recd, BUFFER_SIZE))
-            if not chunk:
-                raise ConnectionError("Socket connection broken while receiving message body")
-            chunks.append(chunk)
-            bytes_recd += len(chunk)
-
-        message_data = b''.join(chunks)
-        return json.loads(message_data.decode('utf-8'))
-    except (ValueError, json.JSONDecodeError) as e:
-        print(f"Error decoding received data: {e}")
-        return None
-    except ConnectionResetError:
-        print("Receive Error: Connection reset by peer.")
-        return None
-    except ConnectionAbortedError:
-        print("Receive Error: Connection aborted.")
-        return None
-    except socket.error as e:
-        # Ignore non-blocking errors
-        if e.errno != 10035 and e.errno != 11: # WSAEWOULDBLOCK / EAGAIN
-            print(f"Socket Receive Error: {e}")
-        return None # Return None for blocking errors too, as data is not fully received
-    except Exception as e:
-        print(f"Unexpected Receive Error: {e}")
-        return None
+def encode_id_message(template, id_value):
+    """Encodes a fixed-shape message whose only variable is an int id to (header, body), skipping the JSON encoder."""
+    prefix, suffix = template
+    body = b'%s%d%s' % (prefix, id_value, suffix)
+    return f"{len(body):<{HEADER_LENGTH}}".encode('utf-8'), body
+
+def diff_snapshot(prev, curr):
+    """Returns the changes from snapshot prev to curr, or None if so much changed that a full snapshot is cheaper.
+
+    Top-level values are included when they differ. Entity sections become {'changed': {id: state}, 'removed': [ids]}.
+    """
+    delta = {}
+    for key, value in curr.items():
+        if key in SNAPSHOT_ENTITY_SECTIONS: continue
+        prev_value = prev.get(key)
+        if value is not prev_value and value != prev_value: delta[key] = value # 'is' first: base_terrain is a shared cached list
+    changed_count = total_count = 0
+    for section in SNAPSHOT_ENTITY_SECTIONS:
+        prev_section, curr_section = prev.get(section, {}), curr.get(section, {})
+        changed = {eid: state for eid, state in curr_section.items() if prev_section.get(eid) != state}
+        removed = list(prev_section.keys() - curr_section.keys())
+        if changed or removed: delta[section] = {'changed': changed, 'removed': removed}
+        changed_count += len(changed) + len(removed); total_count += len(curr_section)
+    if total_count and changed_count > total_count * DELTA_MAX_CHANGED_RATIO: return None
+    return delta
+
+def configure_game_socket(sock):
+    """Tunes a connected game socket: no Nagle delay on small frames and a larger send buffer (best effort)."""
+    try: sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError as e: print(f"WARN: Could not set TCP_NODELAY: {e}")
+    try: sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_SNDBUF_SIZE)
+    except OSError as e: print(f"WARN: Could not set SO_SNDBUF: {e}")
+
+class MessageReader:
+    """Incrementally splits a socket byte stream into length-prefixed JSON messages (frames may span recv calls).
+
+    Data is received straight into one reusable bytearray (recv_into); it only grows, by doubling, when full.
+    """
+    def __init__(self):
+        self.buffer = bytearray(RECV_CHUNK_SIZE); self.view = memoryview(self.buffer)
+        self.length = 0; self.closed = False # Bytes of buffer holding unconsumed data; closed once the peer hangs up
+    def read_from(self, sock):
+        """Reads all data available on a non-blocking socket and returns the complete messages; sets closed once the peer hangs up."""
+        while True:
+            if self.length == len(self.buffer): self._grow()
+            try: received = sock.recv_into(self.view[self.length:])
+            except (BlockingIOError, InterruptedError): break # Drained for now
+            if not received: self.closed = True; break # Connection closed (messages before it are still returned)
+            self.length += received
+        return self.pop_messages()
+    def _grow(self):
+        self.view.release() # A bytearray can't be resized while a memoryview is exported
+        self.buffer.extend(bytes(len(self.buffer))); self.view = memoryview(self.buffer)
+    def pop_messages(self):
+        """Decodes every complete frame in the buffer; a trailing partial frame stays buffered for the next read."""
+        messages = []; buf = self.buffer; start = 0; end = self.length
+        while end - start >= HEADER_LENGTH:
+            message_length = int(buf[start:start + HEADER_LENGTH]) # ValueError on a corrupt header
+            body_start = start + HEADER_LENGTH
+            if end - body_start < message_length: break # Body not fully received yet
+            messages.append(wire_loads(buf[body_start:body_start + message_length]))
+            start = body_start + message_length
+        if start: # Copy the unconsumed tail (a partial frame) to the front; same-size assignment keeps the buffer's size
+            self.length = end - start
+            buf[:self.length] = buf[start:end]
+        return messages
 
 def get_local_ip():
     """Tries to get the local IP address for display."""
@@ -354,6 +460,30 @@ def get_local_ip():
             s.close()
     return ip
 
+# --- JSON File Helpers ---
+def write_json_file(filename, data, indent=2):
+    """Writes data as indented JSON bytes (orjson if available; it always indents by 2).
+
+    The file is written atomically: a temp file is synced to disk and then renamed over the old one, so a crash
+    mid-save leaves the previous save/config intact instead of a truncated file.
+    """
+    if orjson is not None: payload = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    else: payload = json.dumps(data, indent=indent).encode('utf-8')
+    tmp_filename = filename + '.tmp'
+    try:
+        with open(tmp_filename, 'wb') as f:
+            f.write(payload); f.flush(); os.fsync(f.fileno())
+        os.replace(tmp_filename, filename)
+    except Exception:
+        try: os.remove(tmp_filename)
+        except OSError: pass
+        raise
+
+def read_json_file(filename):
+    """Reads a JSON file as raw bytes and decodes it (orjson errors subclass json.JSONDecodeError)."""
+    with open(filename, 'rb') as f: payload = f.read()
+    return orjson.loads(payload) if orjson is not None else json.loads(payload)
+
 # --- Particle Functions ---
 def init_particles(screen_width, screen_height, count):
     """Creates a list of particles with random properties."""
@@ -454,6 +584,7 @@ def draw_particles(surface, particles):
 
 # --- Player Class ---
 class Player:
+    __slots__ = ('player_id', 'world_x', 'world_y', 'radius', 'speed', 'move_x', 'move_y', 'name', 'color_index', 'color', 'last_input_processed')
     def __init__(self, start_x, start_y, player_id, name="Player", color_index=0):
         self.player_id = player_id
         self.world_x = float(start_x)
@@ -507,8 +638,8 @@ class Player:
         """Returns a serializable dictionary representing the player's state."""
         return {
             'id': self.player_id,
-            'x': self.world_x,
-            'y': self.world_y,
+            'x': round(self.world_x, SNAPSHOT_FLOAT_DECIMALS),
+            'y': round(self.world_y, SNAPSHOT_FLOAT_DECIMALS),
             'name': self.name,
             'color_idx': self.color_index,
         }
@@ -525,6 +656,11 @@ class Player:
 
 # --- Structure Classes (Serialization Added) ---
 class Structure:
+    # Fixed attribute layout: no per-instance __dict__ for the many structures built from snapshots
+    __slots__ = ('grid_x', 'grid_y', 'world_x', 'world_y', 'center_x', 'center_y', 'max_hp', 'hp', 'cost', 'color',
+                 'building_type', 'destroyed', 'is_power_node', 'is_power_source', 'is_power_storage', 'is_power_consumer',
+                 'power_consumption', 'is_on_grid', 'is_powered', 'power_source_node', 'power_source_coords',
+                 'connected_nodes_coords', 'tier', 'max_tier', 'upgrade_cost', 'network_id', 'synced_state')
     def __init__(self, gx, gy, hp, cost_dict, color, b_type):
         self.grid_x = gx
         self.grid_y = gy
@@ -549,6 +685,7 @@ class Structure:
         self.max_tier = 1
         self.upgrade_cost = {}
         self.network_id = f"{gx}_{gy}_{b_type}"
+        self.synced_state = None # Last state dict applied from the server (client skips identical snapshots)
 
     def update(self, game):
         pass
@@ -661,7 +798,7 @@ class Structure:
             state.update({'orientation': self.orientation, 'item_type': self.item_type, 'item_count': self.item_count,
                           'item_progress': self.item_progress})
         elif self.building_type == BUILDING_TURRET:
-            state.update({'ammo': self.ammo, 'angle': self.angle})
+            state.update({'ammo': self.ammo, 'angle': round(self.angle, SNAPSHOT_FLOAT_DECIMALS)})
         elif self.building_type == BUILDING_DRILL:
             state.update({'res_held': self.resource_held_count, 'res_type': self.resource_type_held})
         elif self.building_type == BUILDING_COALGENERATOR:
@@ -710,6 +847,7 @@ class Structure:
 # (Keep these subclasses exactly as they were in the previous version, including their draw, update, try_accept, etc. methods)
 # Example:
 class Core(Structure):
+    __slots__ = ()
     def __init__(self, gx, gy):
         super().__init__(gx, gy, CORE_HP, {}, COLOR_BLUE, BUILDING_CORE)
     def draw(self, surface):
@@ -725,6 +863,7 @@ class Core(Structure):
             return False
 
 class ResourcePatch(Structure):
+    __slots__ = ('resource_type',)
     def __init__(self, gx, gy, resource_type):
         self.resource_type = resource_type
         color = COLOR_COPPER if resource_type == RES_COPPER else COLOR_COAL
@@ -739,6 +878,7 @@ class ResourcePatch(Structure):
     def apply_state(self, state_data): pass
 
 class Drill(Structure):
+    __slots__ = ('mining_timer', 'output_timer', 'resource_held_count', 'resource_type_held', 'is_on_patch', 'speed')
     def __init__(self, gx, gy):
         super().__init__(gx, gy, DRILL_STATS[0][1], DRILL_COST, COLOR_DRILL, BUILDING_DRILL)
         self.mining_timer = 0.0; self.output_timer = 0.0
@@ -780,6 +920,7 @@ class Drill(Structure):
             draw_text(surface, f"T{self.tier}", 14, self.world_x + TILE_SIZE - 2, self.world_y + TILE_SIZE - 12, COLOR_WHITE, align="bottomright")
 
 class Conveyor(Structure):
+    __slots__ = ('orientation', 'item_progress', 'item_type', 'item_count', 'transfer_time', 'capacity')
     def __init__(self, gx, gy, orientation=EAST):
         super().__init__(gx, gy, CONVEYOR_STATS[0][1], CONVEYOR_COST, COLOR_CONVEYOR, BUILDING_CONVEYOR)
         self.orientation = orientation; self.item_progress = 0.0
@@ -856,6 +997,7 @@ class Conveyor(Structure):
                 pygame.draw.rect(surface, COLOR_BLACK, item_rect, 1)
 
 class Turret(Structure):
+    __slots__ = ('fire_timer', 'ammo', 'capacity', 'target_id', 'angle', 'range', 'range_sq', 'damage', 'fire_rate')
     def __init__(self, gx, gy):
         super().__init__(gx, gy, TURRET_STATS[0][3], TURRET_COST, COLOR_TURRET, BUILDING_TURRET)
         self.fire_timer = random.uniform(0, TURRET_STATS[0][2]); self.ammo = 0
@@ -884,7 +1026,7 @@ class Turret(Structure):
         target_lost = (target_enemy is None or target_enemy.destroyed or
                        distance_sq(self.center_x, self.center_y, target_enemy.world_x, target_enemy.world_y) > self.range_sq)
         if target_lost:
-            new_target = self.find_target(game.enemies)
+            new_target = self.find_target(game)
             self.target_id = new_target.network_id if new_target else None
             target_enemy = new_target
         if target_enemy is not None:
@@ -897,9 +1039,9 @@ class Turret(Structure):
                 if self.tier < 3: self.ammo -= TURRET_AMMO_CONSUMPTION
                 proj = Projectile(self.center_x, self.center_y, target_enemy, PROJECTILE_SPEED, self.damage, game.get_next_projectile_id())
                 game.projectiles[proj.network_id] = proj
-    def find_target(self, enemies_dict):
+    def find_target(self, game):
         closest = None; min_d_sq = self.range_sq
-        for enemy in enemies_dict.values():
+        for enemy in game.query_radius(self.center_x, self.center_y, self.range):
             if enemy.destroyed: continue
             d_sq = distance_sq(self.center_x, self.center_y, enemy.world_x, enemy.world_y)
             if d_sq <= self.range_sq and (closest is None or d_sq < min_d_sq):
@@ -918,6 +1060,7 @@ class Turret(Structure):
              draw_text(surface, f"T{self.tier}", 14, self.world_x + TILE_SIZE - 2, self.world_y + TILE_SIZE - 12, COLOR_WHITE, align="bottomright")
 
 class Wall(Structure):
+    __slots__ = ()
     def __init__(self, gx, gy):
         super().__init__(gx, gy, WALL_HP, WALL_COST, COLOR_WALL, BUILDING_WALL)
     def draw(self, surface):
@@ -928,6 +1071,7 @@ class Wall(Structure):
         pygame.draw.line(surface, COLOR_DARK_GRAY, (self.world_x + 1, self.world_y + s), (self.world_x + s, self.world_y + s), 2)
 
 class CoalGenerator(Structure):
+    __slots__ = ('coal_buffer', 'consume_timer')
     def __init__(self, gx, gy):
         super().__init__(gx, gy, COALGENERATOR_HP, COALGENERATOR_COST, COLOR_GENERATOR, BUILDING_COALGENERATOR)
         self.coal_buffer = 0; self.consume_timer = 0.0; self.is_power_node = True
@@ -951,10 +1095,11 @@ class CoalGenerator(Structure):
             bar_h = TILE_SIZE * 0.8 * ratio; bar_w = 4
             bar_x, bar_y = self.world_x + 2, self.world_y + TILE_SIZE - 2 - bar_h
             pygame.draw.rect(surface, COLOR_COAL, (bar_x, bar_y, bar_w, bar_h))
-        if self.is_power_source and int(time.time() * 4) % 2 == 0:
+        if self.is_power_source and int(time.monotonic() * 4) % 2 == 0:
             pygame.draw.circle(surface, COLOR_YELLOW, (int(self.center_x), int(self.center_y)), 5)
 
 class PowerPole(Structure):
+    __slots__ = ()
     def __init__(self, gx, gy):
         super().__init__(gx, gy, POWERPOLE_HP, POWERPOLE_COST, COLOR_POLE, BUILDING_POWERPOLE)
         self.is_power_node = True
@@ -963,6 +1108,7 @@ class PowerPole(Structure):
         if self.is_on_grid: pygame.draw.circle(surface, COLOR_POWER_LINE, (int(self.center_x), int(self.center_y)), 4)
 
 class Battery(Structure):
+    __slots__ = ('charge', 'capacity', 'charge_rate', 'discharge_rate', 'is_charging', 'is_discharging')
     def __init__(self, gx, gy):
         super().__init__(gx, gy, BATTERY_HP, BATTERY_COST, COLOR_BATTERY, BUILDING_BATTERY)
         self.is_power_node = True; self.is_power_storage = True; self.charge = 0.0
@@ -984,6 +1130,7 @@ class Battery(Structure):
         if status_color: pygame.draw.circle(surface, status_color, (int(self.center_x), int(self.center_y)), 4)
 
 class Reconstructor(Structure):
+    __slots__ = ('repair_timer', 'repair_radius_sq')
     def __init__(self, gx, gy):
         super().__init__(gx, gy, RECONSTRUCTOR_HP, RECONSTRUCTOR_COST, COLOR_RECONSTRUCTOR, BUILDING_RECONSTRUCTOR)
         self.is_power_consumer = True; self.power_consumption = RECONSTRUCTOR_POWER_CONSUMPTION
@@ -1017,11 +1164,13 @@ class Reconstructor(Structure):
 # --- Enemy & Projectile Classes ---
 # (Keep Enemy and Projectile classes exactly as they were in the previous corrected version)
 class Enemy:
+    __slots__ = ('network_id', 'world_x', 'world_y', 'target_core_coords', 'current_attack_target_id', 'max_hp', 'hp', 'speed', 'damage', 'attack_cooldown', 'attack_timer', 'destroyed', 'synced_state')
     def __init__(self, sx, sy, target_core_coords, hp, speed, dmg, atk_cd, network_id):
         self.network_id = network_id; self.world_x = float(sx); self.world_y = float(sy)
         self.target_core_coords = target_core_coords; self.current_attack_target_id = None
         self.max_hp = hp; self.hp = hp; self.speed = speed; self.damage = dmg
         self.attack_cooldown = atk_cd; self.attack_timer = 0.0; self.destroyed = False
+        self.synced_state = None # Last state dict applied from the server (client skips identical snapshots)
     def update(self, game):
         if self.destroyed: return
         speed_this_frame = self.speed * game.dt
@@ -1101,12 +1250,15 @@ class Enemy:
                 pygame.draw.rect(surface, COLOR_RED, (bar_x, bar_y, bar_w, bar_h))
                 if ratio > 0: pygame.draw.rect(surface, COLOR_GREEN, (bar_x, bar_y, bar_w * ratio, bar_h))
     def get_state(self):
-        return {'net_id': self.network_id, 'x': self.world_x, 'y': self.world_y, 'hp': self.hp, 'max_hp': self.max_hp}
+        return {'net_id': self.network_id, 'x': round(self.world_x, SNAPSHOT_FLOAT_DECIMALS), 'y': round(self.world_y, SNAPSHOT_FLOAT_DECIMALS),
+                'hp': self.hp, 'max_hp': self.max_hp}
     def apply_state(self, state_data):
-        self.world_x = state_data.get('x', self.world_x); self.world_y = state_data.get('y', self.world_y)
-        self.hp = state_data.get('hp', self.hp); self.max_hp = state_data.get('max_hp', self.max_hp)
+        get = state_data.get # Bound once; called per enemy per snapshot
+        self.world_x = get('x', self.world_x); self.world_y = get('y', self.world_y)
+        self.hp = get('hp', self.hp); self.max_hp = get('max_hp', self.max_hp)
 
 class Projectile:
+    __slots__ = ('network_id', 'world_x', 'world_y', 'target_enemy_id', 'speed', 'damage', 'destroyed', 'lifetime', 'vx', 'vy')
     def __init__(self, sx, sy, target_enemy_obj, speed, dmg, network_id, vx=None, vy=None):
         self.network_id = network_id; self.world_x = float(sx); self.world_y = float(sy)
         self.target_enemy_id = target_enemy_obj.network_id if target_enemy_obj else None
@@ -1132,10 +1284,13 @@ class Projectile:
         if not self.destroyed: self.world_x += self.vx * dt; self.world_y += self.vy * dt
     def draw(self, surface):
         if not self.destroyed: pygame.draw.circle(surface, COLOR_PROJECTILE, (int(self.world_x), int(self.world_y)), 4)
-    def get_state(self): return {'net_id': self.network_id, 'x': self.world_x, 'y': self.world_y, 'vx': self.vx, 'vy': self.vy}
+    def get_state(self):
+        r = SNAPSHOT_FLOAT_DECIMALS
+        return {'net_id': self.network_id, 'x': round(self.world_x, r), 'y': round(self.world_y, r), 'vx': round(self.vx, r), 'vy': round(self.vy, r)}
     def apply_state(self, state_data):
-        self.world_x = state_data.get('x', self.world_x); self.world_y = state_data.get('y', self.world_y)
-        self.vx = state_data.get('vx', self.vx); self.vy = state_data.get('vy', self.vy)
+        get = state_data.get # Bound once; called per projectile per snapshot
+        self.world_x = get('x', self.world_x); self.world_y = get('y', self.world_y)
+        self.vx = get('vx', self.vx); self.vy = get('vy', self.vy)
 
 
 # --- Settings Menu Class ---
@@ -1368,6 +1523,9 @@ class SettingsMenu:
         }
 
 # --- Game Class ---
+class SnapshotApplyError(Exception):
+    """Raised when a snapshot section cannot be applied; the next full snapshot resyncs the state."""
+
 class Game:
     def __init__(self, screen, clock, player_settings, network_mode="sp", server=None, client=None, load_data=None): # Added load_data
         self.screen = screen
@@ -1410,17 +1568,22 @@ class Game:
         # --- END MODIFIED ---
 
         # --- Initialize containers (always needed) ---
-        self.grid = [[None for _ in range(self.grid_height)] for _ in range(self.grid_width)]
+        self.grid = self._blank_grid()
         self.structures = {} # network_id -> Structure object
         self.enemies = {}    # network_id -> Enemy object
         self.projectiles = {}# network_id -> Projectile object
         self.core = None
         self.base_terrain = {} # (gx, gy) -> RES_TYPE (only stores resource patches)
+        self._terrain_snapshot = None # Cached [gx, gy, RES_TYPE] list for snapshots; None = rebuild (terrain changed)
+        self._spatial_hash = {} # (cell_x, cell_y) -> [Enemy], rebuilt each update (see rebuild_spatial_hash)
         self.players = {}      # player_id -> Player object
         # ------------------------------------------
 
         self.local_player_id = None # Will be set based on mode/load/network assignment
         self.dt = 0.0               # Delta time for current frame
+        self.tick_count = 0         # Simulation frames run so far (lets the server reuse per-tick work)
+        self.snapshot_id = None     # Client: id of the server snapshot our state matches (state_delta baseline)
+        self.state_dirty = True     # Host: something a snapshot carries changed since the last state broadcast
 
         # --- UI/Input State ---
         self.selected_building_type = BUILDING_NONE
@@ -1437,6 +1600,16 @@ class Game:
         }
         self.key_to_building_type = {pygame.K_0 + i: bt for i, bt in enumerate(self.building_info.keys(), 1)}
         self.preview_instances = self._create_preview_instances()
+        self._ui_sections, self._key_num_map, self._build_button_labels = self._build_ui_layout_cache()
+        self._update_handlers = self._build_update_handlers() # Incremental network message type -> handler
+        self._scratch_player_ids = set() # Reused by _apply_section_players every snapshot instead of a fresh set
+        # Build preview surfaces: tints are fixed, previews are cached per (type, orientation, tint) on first use
+        self._tint_surfaces = {}
+        for tint_color in (COLOR_INVALID_RADIUS, (*COLOR_RED[:3], 120), (*COLOR_YELLOW[:3], 120)):
+            tint_surface = pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
+            tint_surface.fill(tint_color)
+            self._tint_surfaces[tint_color] = tint_surface
+        self._preview_surfaces = {}
         # --- End UI/Input ---
 
         # --- Power Grid State ---
@@ -1463,8 +1636,9 @@ class Game:
 
         # --- Music Attributes ---
         self.game_music_files = sorted(glob.glob(GAME_MUSIC_FILES_PATTERN))
+        self.game_music_basenames = [os.path.basename(f) for f in self.game_music_files] # Display names, parallel to game_music_files
         self.current_song_index = -1 # No song selected initially
-        self.music_playing = False # Tracks if we intend it to play (vs mixer's state)
+        self._music_state = MUSIC_STOPPED # Tracks if we intend it to play (vs mixer's state)
         self.prev_button_rect = None
         self.play_pause_button_rect = None
         self.next_button_rect = None
@@ -1477,7 +1651,7 @@ class Game:
         # Calculate initial UI positions (includes slider now)
         self._setup_music_controls_ui()
         if self.game_music_files:
-            print(f"Found game music: {', '.join([os.path.basename(f) for f in self.game_music_files])}")
+            print(f"Found game music: {', '.join(self.game_music_basenames)}")
         else:
             print("WARN: No game music files found matching pattern.")
         # Set initial mixer volume for the game instance
@@ -1536,7 +1710,7 @@ class Game:
                 self.wave_number = 0; self.wave_timer = WAVE_COOLDOWN; self.in_wave = False
                 self.game_over = False; self.game_won = False
                 self.enemies = {}; self.projectiles = {}; self.structures = {} # Clear containers
-                self.grid = [[None for _ in range(self.grid_height)] for _ in range(self.grid_width)] # Reset grid
+                self.grid = self._blank_grid() # Reset grid
                 self.next_enemy_id = 0; self.next_projectile_id = 0
                 self.local_player_id = 0 # Ensure local ID is set for new game
                 self.setup_world() # Run new game setup
@@ -1572,6 +1746,28 @@ class Game:
                  print(f"Error creating preview instance for {info['name']}: {e}")
         return previews
 
+    def _build_ui_layout_cache(self):
+        """Precomputes the static build menu data (sections, key numbers, button labels) used by draw_ui."""
+        sections = {'Production': [], 'Logistics': [], 'Defense': [], 'Power': [], 'Support': []}
+        # Group buildings by section
+        for bt, info in self.building_info.items():
+            sections.setdefault(info.get('section', 'Other'), []).append(bt)
+        # Drop empty sections so draw_ui doesn't have to skip them every frame
+        sections = {name: bts for name, bts in sections.items() if bts}
+
+        # Inverse map for getting key number
+        key_num_map = {v: k for k, v in self.key_to_building_type.items()}
+
+        button_labels = {}
+        for bt, info in self.building_info.items():
+            # Format cost string (e.g., "15C+5Co")
+            cost_str = "+".join([f"{a}{'C' if r == RES_COPPER else 'Co'}" for r, a in info['cost'].items()])
+            # Get key number (1-8)
+            key_code = key_num_map.get(bt, 0)
+            key_display = str(key_code - pygame.K_0) if key_code >= pygame.K_1 else '?'
+            button_labels[bt] = f"[{key_display}] {info['name']} ({cost_str})"
+        return sections, key_num_map, button_labels
+
     def get_next_enemy_id(self):
         """Generates a unique network ID for a new enemy (Server/SP)."""
         self.next_enemy_id += 1
@@ -1588,11 +1784,12 @@ class Game:
 
         print(f"SERVER/SP: Setting up NEW world for grid {self.grid_width}x{self.grid_height}...")
         self.base_terrain.clear()
+        self._terrain_snapshot = None
         self.structures.clear()
         self.enemies.clear()
         self.projectiles.clear()
         self.players.clear()
-        self.grid = [[None for _ in range(self.grid_height)] for _ in range(self.grid_width)] # Clear grid
+        self.grid = self._blank_grid() # Clear grid
 
         # --- Place Core ---
         core_gx = self.grid_width // 2
@@ -1711,29 +1908,23 @@ class Game:
     def _remove_structure_from_game(self, structure_obj):
         """Removes a structure from the grid and internal dictionary."""
         if structure_obj is None: return
-        gx, gy = structure_obj.grid_x, structure_obj.grid_y
-        removed_id = structure_obj.network_id
 
-        # Remove from structures dictionary
-        if removed_id in self.structures:
-            del self.structures[removed_id]
-            # print(f"DEBUG: Removed {type(structure_obj).__name__} ({removed_id}) from dict.")
-        else:
-            # This might happen if removing a ResourcePatch visual, which isn't in self.structures
-            # print(f"DEBUG: Structure {removed_id} not found in dict during removal.")
-            pass
+        # Remove from structures dictionary (missing for ResourcePatch visuals, which aren't in self.structures)
+        self.structures.pop(structure_obj.network_id, None)
 
         # Update power network tracking (Server/SP only)
         if self.network_mode != "client":
             self._update_power_lists_remove(structure_obj)
 
         # Update grid display: Replace with ResourcePatch if base terrain exists, else None
-        if 0 <= gx < self.grid_width and 0 <= gy < self.grid_height and self.grid[gx][gy] == structure_obj:
+        self._clear_structure_cell(structure_obj)
+
+    def _clear_structure_cell(self, structure_obj):
+        """Clears the grid cell if it still holds structure_obj, restoring the ResourcePatch visual on patch tiles."""
+        gx, gy = structure_obj.grid_x, structure_obj.grid_y
+        if 0 <= gx < self.grid_width and 0 <= gy < self.grid_height and self.grid[gx][gy] is structure_obj:
              base_type = self.base_terrain.get((gx, gy)) # Check if it was originally a resource patch
-             if base_type:
-                 self.grid[gx][gy] = ResourcePatch(gx, gy, base_type) # Restore visual patch
-             else:
-                 self.grid[gx][gy] = None # Clear the grid cell
+             self.grid[gx][gy] = ResourcePatch(gx, gy, base_type) if base_type else None
 
     def _rebuild_power_lists(self):
         """Re-populates the power_nodes and power_consumers lists from self.structures. (Server/SP only)"""
@@ -1814,6 +2005,7 @@ class Game:
             # Refund cost if adding failed
             for res, amount in cost.items(): self.resources[res] += amount
             return False
+        self.state_dirty = True
 
         # 4. Broadcast (Host only)
         if self.network_mode == "host" and self.server:
@@ -1845,6 +2037,7 @@ class Game:
 
         removed_id = struct_to_remove.network_id # Get ID before removing
         self._remove_structure_from_game(struct_to_remove)
+        self.state_dirty = True
 
         # 3. Broadcast (Host only)
         if self.network_mode == "host" and self.server:
@@ -1880,6 +2073,7 @@ class Game:
 
         # 3. Handle State Changes & Broadcast
         if success:
+            self.state_dirty = True
             # Update power lists if role changed (Server/SP only)
             if self.network_mode != "client":
                 if (target.is_power_consumer != was_consumer or target.is_power_node != was_node):
@@ -1908,6 +2102,29 @@ class Game:
         """Gets an enemy object by its unique network ID."""
         return self.enemies.get(network_id)
 
+    def rebuild_spatial_hash(self):
+        """Buckets enemies by SPATIAL_HASH_CELL_SIZE cell for query_radius (Server/SP, once per update)."""
+        cells = {}
+        for enemy in self.enemies.values():
+            key = (int(enemy.world_x // SPATIAL_HASH_CELL_SIZE), int(enemy.world_y // SPATIAL_HASH_CELL_SIZE))
+            bucket = cells.get(key)
+            if bucket is None: cells[key] = [enemy]
+            else: bucket.append(enemy)
+        self._spatial_hash = cells
+
+    def query_radius(self, cx, cy, r):
+        """Returns enemies in the hash cells overlapping the circle's bounding box (callers do the exact distance check)."""
+        cells = self._spatial_hash
+        if not cells: return []
+        min_cx, max_cx = int((cx - r) // SPATIAL_HASH_CELL_SIZE), int((cx + r) // SPATIAL_HASH_CELL_SIZE)
+        min_cy, max_cy = int((cy - r) // SPATIAL_HASH_CELL_SIZE), int((cy + r) // SPATIAL_HASH_CELL_SIZE)
+        found = []
+        for hx in range(min_cx, max_cx + 1):
+            for hy in range(min_cy, max_cy + 1):
+                bucket = cells.get((hx, hy))
+                if bucket: found.extend(bucket)
+        return found
+
     def get_projectile_by_id(self, network_id):
         """Gets a projectile object by its unique network ID."""
         return self.projectiles.get(network_id)
@@ -2140,16 +2357,11 @@ class Game:
             # Explore neighbors using connected_nodes_coords
             # This requires finding node IDs corresponding to the coordinates
             for neighbor_coords in getattr(current_node, 'connected_nodes_coords', []):
-                found_neighbor_id = None
-                # Inefficient search for neighbor matching coords - OK for tooltip?
-                for potential_id, potential_node in self.structures.items():
-                    if (potential_node.is_power_node and potential_id not in visited_ids and
-                            abs(potential_node.center_x - neighbor_coords[0]) < 1.0 and
-                            abs(potential_node.center_y - neighbor_coords[1]) < 1.0):
-                        found_neighbor_id = potential_id
-                        break # Found the neighbor
-
-                if found_neighbor_id:
+                # Coords are tile centers, so the grid gives the neighbor directly (no scan of self.structures)
+                potential_node = self.get_structure_at(*world_to_grid(neighbor_coords[0], neighbor_coords[1]))
+                if potential_node is None or not potential_node.is_power_node: continue
+                found_neighbor_id = potential_node.network_id
+                if found_neighbor_id not in visited_ids and found_neighbor_id in self.structures:
                     visited_ids.add(found_neighbor_id)
                     queue.append(found_neighbor_id)
 
@@ -2160,13 +2372,10 @@ class Game:
              if consumer.is_power_consumer and getattr(consumer, 'is_powered', False):
                  source_coords = getattr(consumer, 'power_source_coords', None)
                  if source_coords:
-                     # Check if the source coords match any node in the network we just BFS'd
-                     for node_id in network_node_ids:
-                         node = self.structures.get(node_id)
-                         if node and abs(node.center_x - source_coords[0]) < 1.0 and abs(node.center_y - source_coords[1]) < 1.0:
-                             # Found the source node within this network, count the consumption
-                             stats['consumption'] += consumer.power_consumption
-                             break # Count consumption only once per consumer
+                     # Check if the source coords match a node in the network we just BFS'd
+                     node = self.get_structure_at(*world_to_grid(source_coords[0], source_coords[1]))
+                     if node is not None and node.network_id in network_node_ids:
+                         stats['consumption'] += consumer.power_consumption
 
         self.network_stats = stats # Store calculated stats
 
@@ -2331,13 +2540,25 @@ class Game:
     def update(self):
         """Updates the game state for one frame."""
         if not self.running: return # Should not be called if not running, but safety check
+        self.tick_count += 1
 
         # --- Server / Single Player Update Logic ---
         if self.network_mode in ["host", "sp"]:
+            # Values the broadcast gate compares against after the tick (see the end of this branch)
+            resources_before = self.resources.copy()
+            core_hp_before = self.core.hp if self.core else 0
+            ended_before = (self.game_over, self.game_won)
+
             # Update Players
+            players_moved = False
             for player in self.players.values():
+                if player.move_x or player.move_y: players_moved = True
                 player.update(self.dt, self) # Pass self for map bounds
 
+            # Bucket enemies once so turret targeting only looks at nearby cells.
+            # Turrets update before enemies move, so positions stay exact for this frame.
+            self.rebuild_spatial_hash()
+
             # Update Structures
             # Iterate over list copy in case structures are added/removed during update
             for struct in list(self.structures.values()):
@@ -2348,8 +2569,11 @@ class Game:
                 enemy.update(self) # Movement, targeting, attacking
 
             # Update Projectiles
-            for proj in list(self.projectiles.values()):
+            # Projectiles only flag themselves destroyed in their own update, so collect them in the same pass
+            destroyed_projectile_ids = []
+            for pid, proj in list(self.projectiles.items()):
                 proj.update(self) # Movement, collision check
+                if proj.destroyed: destroyed_projectile_ids.append(pid)
 
             # Update Power Grid periodically
             self.power_grid_update_timer += self.dt
@@ -2361,18 +2585,16 @@ class Game:
             destroyed_structure_ids = [sid for sid, s in self.structures.items() if s.destroyed]
             core_destroyed_this_frame = False
             for sid in destroyed_structure_ids:
-                 if sid in self.structures: # Check if not already removed
-                     if self.structures[sid].building_type == BUILDING_CORE:
-                         core_destroyed_this_frame = True
-                     self._remove_structure_from_game(self.structures[sid])
+                 struct = self.structures.get(sid) # None if already removed
+                 if struct is None: continue
+                 if struct.building_type == BUILDING_CORE:
+                     core_destroyed_this_frame = True
+                 self._remove_structure_from_game(struct)
 
             destroyed_enemy_ids = [eid for eid, e in self.enemies.items() if e.destroyed]
-            for eid in destroyed_enemy_ids:
-                 if eid in self.enemies: del self.enemies[eid] # Remove from dict
+            for eid in destroyed_enemy_ids: self.enemies.pop(eid, None)
 
-            destroyed_projectile_ids = [pid for pid, p in self.projectiles.items() if p.destroyed]
-            for pid in destroyed_projectile_ids:
-                 if pid in self.projectiles: del self.projectiles[pid] # Remove from dict
+            for pid in destroyed_projectile_ids: self.projectiles.pop(pid, None)
 
             # Broadcast removals if host
             if self.network_mode == "host" and self.server:
@@ -2442,23 +2664,36 @@ class Game:
                           self.server.broadcast_message({'type': 'game_status', 'status': 'won'})
             # --- End Game End ---
 
+            # Only flag a broadcast when this tick may have changed something a snapshot carries.
+            # Structures keep ticking after the game ends (buffers, conveyor items, turret aim), so any structure counts;
+            # broadcast_state drops a snapshot identical to the last one.
+            if (self.structures or players_moved or self.enemies or self.projectiles or destroyed_structure_ids
+                    or not ended_before[0] and not ended_before[1]
+                    or self.resources != resources_before
+                    or (self.core.hp if self.core else 0) != core_hp_before
+                    or (self.game_over, self.game_won) != ended_before):
+                self.state_dirty = True
+
         # --- Client Update Logic ---
         elif self.network_mode == "client":
             # Clients mainly rely on server state updates (apply_full_snapshot / apply_incremental_update)
             # Client-side updates are mostly for visual smoothing / prediction / local effects
 
+            dt = self.dt
             # Update structure animations (e.g., conveyor item movement) based on last known state
+            # (bound call: Conveyor overrides client_update, so an unbound Structure.client_update would skip it)
             for struct in self.structures.values():
-                struct.client_update(self.dt) # Handles item progress on conveyors visually
+                struct.client_update(dt) # Handles item progress on conveyors visually
 
             # Update projectile positions visually based on last known velocity
+            proj_client_update = Projectile.client_update # No subclasses, safe to call unbound
             for proj in self.projectiles.values():
-                proj.client_update(self.dt) # Simple linear movement
+                proj_client_update(proj, dt) # Simple linear movement
 
             # Update local player visual position (can add prediction/interpolation later)
             local_player = self.players.get(self.local_player_id)
             if local_player:
-                local_player.update(self.dt, self) # Update visual pos using self for bounds
+                local_player.update(dt, self) # Update visual pos using self for bounds
 
             # Update network stats tooltip calculation timer
             if self.hovered_power_node_id:
@@ -2508,12 +2743,17 @@ class Game:
         for struct in self.structures.values():
             # Node must exist, be a node, and be marked as on_grid in its state
             if struct.is_power_node and getattr(struct, 'is_on_grid', False):
-                node_center_int = (int(struct.center_x), int(struct.center_y))
+                node_x, node_y = int(struct.center_x), int(struct.center_y)
+                node_center_int = (node_x, node_y)
+                node_packed = (node_x & 0xFFFF) << 16 | (node_y & 0xFFFF) # Endpoint packed into one int
                 # Use the synced coordinates list to draw lines
                 for neighbor_coords in getattr(struct, 'connected_nodes_coords', []):
-                    neighbor_center_int = (int(neighbor_coords[0]), int(neighbor_coords[1]))
-                    # Create sorted tuple key to avoid duplicates (A->B vs B->A)
-                    connection_key = tuple(sorted((node_center_int, neighbor_center_int)))
+                    neighbor_x, neighbor_y = int(neighbor_coords[0]), int(neighbor_coords[1])
+                    neighbor_center_int = (neighbor_x, neighbor_y)
+                    neighbor_packed = (neighbor_x & 0xFFFF) << 16 | (neighbor_y & 0xFFFF)
+                    # Order-independent int key to avoid duplicates (A->B vs B->A)
+                    if node_packed < neighbor_packed: connection_key = node_packed << 32 | neighbor_packed
+                    else: connection_key = neighbor_packed << 32 | node_packed
                     if connection_key not in drawn_connections:
                         pygame.draw.line(self.screen, line_color, node_center_int, neighbor_center_int, 1)
                         drawn_connections.add(connection_key)
@@ -2583,26 +2823,30 @@ class Game:
 
         # --- Draw Preview ---
         try:
-            # Create a surface for the preview instance
-            preview_surf = pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
-            # Set world position to 0,0 for drawing on the surface
-            preview_instance.world_x, preview_instance.world_y = 0, 0
-            preview_instance.center_x, preview_instance.center_y = TILE_SIZE / 2.0, TILE_SIZE / 2.0
-            # Update orientation if it's a conveyor
-            if isinstance(preview_instance, Conveyor):
-                 preview_instance.orientation = self.selected_orientation
-            # Draw the building onto the temporary surface
-            preview_instance.draw(preview_surf)
-            preview_surf.set_alpha(preview_alpha)
-
-            # Apply tint if needed
-            if tint_color:
-                tint_surface = pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
-                tint_surface.fill(tint_color)
-                # Blend the tint color multiplicatively onto the preview surface
-                preview_surf.blit(tint_surface, (0, 0), special_flags=pygame.BLEND_RGBA_MULT)
+            # Preview instances never change, so the tinted surface is rendered once per (type, orientation, tint)
+            orientation = self.selected_orientation if isinstance(preview_instance, Conveyor) else 0
+            cache_key = (self.selected_building_type, orientation, tint_color)
+            preview_surf = self._preview_surfaces.get(cache_key)
+            if preview_surf is None:
+                # Create a surface for the preview instance
+                preview_surf = pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
+                # Set world position to 0,0 for drawing on the surface
+                preview_instance.world_x, preview_instance.world_y = 0, 0
+                preview_instance.center_x, preview_instance.center_y = TILE_SIZE / 2.0, TILE_SIZE / 2.0
+                # Update orientation if it's a conveyor
+                if isinstance(preview_instance, Conveyor):
+                     preview_instance.orientation = orientation
+                # Draw the building onto the temporary surface
+                preview_instance.draw(preview_surf)
+
+                # Apply tint if needed
+                if tint_color:
+                    # Blend the tint color multiplicatively onto the preview surface
+                    preview_surf.blit(self._tint_surfaces[tint_color], (0, 0), special_flags=pygame.BLEND_RGBA_MULT)
+                self._preview_surfaces[cache_key] = preview_surf
 
             # Blit the final preview surface onto the main screen
+            preview_surf.set_alpha(preview_alpha)
             self.screen.blit(preview_surf, (world_x, world_y))
         except Exception as e:
              print(f"ERROR drawing build preview for {info['name']}: {e}")
@@ -2674,22 +2918,12 @@ class Game:
 
         # --- Build Menu ---
         y_build_start = ui_rect.y + 45 # Start lower down
-        sections = {'Production': [], 'Logistics': [], 'Defense': [], 'Power': [], 'Support': []}
-        # Group buildings by section
-        for bt, info in self.building_info.items():
-            sections.setdefault(info.get('section', 'Other'), []).append(bt)
-
         current_build_x = padding
         section_spacing = 15
         item_spacing = 10
         item_y_offset = 20 # Space below section header
 
-        # Inverse map for getting key number
-        key_num_map = {v: k for k, v in self.key_to_building_type.items()}
-
-        for section_name, building_types in sections.items():
-            if not building_types: continue # Skip empty sections
-
+        for section_name, building_types in self._ui_sections.items():
             header_y = y_build_start
             draw_text(self.screen, section_name, build_h_fs, current_build_x, header_y, COLOR_UI_HEADER)
             header_width_approx = len(section_name) * 8 # Estimate width
@@ -2699,13 +2933,7 @@ class Game:
 
             for bt in building_types:
                 info = self.building_info[bt]
-                # Format cost string (e.g., "15C+5Co")
-                cost_str = "+".join([f"{a}{'C' if r == RES_COPPER else 'Co'}" for r, a in info['cost'].items()])
-                # Get key number (1-8)
-                key_code = key_num_map.get(bt, 0)
-                key_display = str(key_code - pygame.K_0) if key_code >= pygame.K_1 else '?'
-
-                button_text = f"[{key_display}] {info['name']} ({cost_str})"
+                button_text = self._build_button_labels[bt] # Precomputed in __init__
 
                 is_selected = (self.selected_building_type == bt)
                 can_afford = all(self.resources.get(res, 0) >= amount for res, amount in info['cost'].items())
@@ -2824,7 +3052,7 @@ class Game:
         buttons_to_draw = [
             (self.prev_button_rect, "<<"),
             # Dynamic label for play/pause button
-            (self.play_pause_button_rect, "||" if self.music_playing else ">"),
+            (self.play_pause_button_rect, "||" if self._music_state == MUSIC_PLAYING else ">"),
             (self.next_button_rect, ">>")
         ]
 
@@ -2840,7 +3068,7 @@ class Game:
         # Position below the buttons
         if font_tiny and self.current_song_index != -1 and self.prev_button_rect:
              try:
-                 song_name = os.path.basename(self.game_music_files[self.current_song_index])
+                 song_name = self.game_music_basenames[self.current_song_index]
                  name_x = self.prev_button_rect.left # Align with first button
                  name_y = self.prev_button_rect.bottom + 5 # Position below buttons
                  draw_text(self.screen, song_name, 14, name_x, name_y, COLOR_GRAY, align="topleft")
@@ -2869,13 +3097,21 @@ class Game:
         for player in self.players.values():
             player.draw(self.screen)
 
-        # 6. Enemies
+        # Visible game area (plus a margin for HP bars etc.) used to cull enemies/projectiles.
+        # Structures always sit on the grid inside the map, so they are not culled.
+        cull_margin = TILE_SIZE * 2
+        vis_left, vis_top = -cull_margin, -cull_margin
+        vis_right, vis_bottom = self.screen.get_width() + cull_margin, self.map_height_px + cull_margin
+
+        # 6. Enemies (spawn off-map, so skip those not yet visible)
         for enemy in self.enemies.values():
-            enemy.draw(self.screen)
+            if vis_left <= enemy.world_x < vis_right and vis_top <= enemy.world_y < vis_bottom:
+                enemy.draw(self.screen)
 
         # 7. Projectiles
         for proj in self.projectiles.values():
-            proj.draw(self.screen)
+            if vis_left <= proj.world_x < vis_right and vis_top <= proj.world_y < vis_bottom:
+                proj.draw(self.screen)
 
         # 8. Build Preview (Ghost image under cursor)
         self.draw_build_preview()
@@ -2898,45 +3134,114 @@ class Game:
     def get_full_snapshot(self):
         """Gets the complete game state, suitable for saving or networking."""
         if self.network_mode == "client": return None # Clients don't generate snapshots
+        return self.serialize_snapshot(self.collect_snapshot_refs())
 
-        # Convert terrain keys to strings for JSON compatibility
-        string_key_terrain = {}
-        for (gx, gy), r in self.base_terrain.items():
-            string_key_terrain[f"{gx},{gy}"] = r
+    def collect_snapshot_refs(self):
+        """Copies the scalar state and entity references a snapshot needs; the cheap part to run under game_lock."""
+        # Terrain is static after generation, so the JSON-friendly [gx, gy, res] list is built once and reused
+        if self._terrain_snapshot is None:
+            self._terrain_snapshot = [[gx, gy, r] for (gx, gy), r in self.base_terrain.items()]
 
-        snapshot = {
+        return {
             'resources': self.resources.copy(),
             'wave_number': self.wave_number,
             'wave_timer': self.wave_timer,
             'in_wave': self.in_wave,
             'game_over': self.game_over,
             'game_won': self.game_won,
-            'players': {pid: p.get_state() for pid, p in self.players.items()},
-            # Ensure ResourcePatch objects are NOT included in structures snapshot
-            'structures': {sid: s.get_state() for sid, s in self.structures.items() if s.building_type != BUILDING_RESOURCE},
-            'enemies': {eid: e.get_state() for eid, e in self.enemies.items()},
-            'projectiles': {pid: p.get_state() for pid, p in self.projectiles.items()},
-            'base_terrain': string_key_terrain,
+            # Entity dicts are captured as item tuples: later adds/removes can't affect them, get_state runs without the lock
+            'players': tuple(self.players.items()),
+            # ResourcePatch objects only live on self.grid (never in self.structures), so no per-entity filter is needed
+            'structures': tuple(self.structures.items()),
+            'enemies': tuple(self.enemies.items()),
+            'projectiles': tuple(self.projectiles.items()),
+            'base_terrain': self._terrain_snapshot,
             'core_hp': self.core.hp if self.core else 0,
             'core_max_hp': self.core.max_hp if self.core else CORE_HP,
             # --- ADDED FOR SAVING ---
             'next_enemy_id': self.next_enemy_id,
             'next_projectile_id': self.next_projectile_id,
-            'game_mode_for_save': self.network_mode # Store mode ('sp' or 'host')
+            # 'game_mode_for_save' is added by save_game_state only. Network snapshots must not carry it,
+            # otherwise clients treat every state_update as a save load and rebuild terrain + grid each time.
             # ------------------------
         }
+
+    def serialize_snapshot(self, refs):
+        """Turns collect_snapshot_refs output into a snapshot dict (the O(N) get_state walk; no lock needed)."""
+        snapshot = dict(refs)
+        for section in SNAPSHOT_ENTITY_SECTIONS:
+            snapshot[section] = {eid: entity.get_state() for eid, entity in refs[section]}
         return snapshot
 
-    def apply_full_snapshot(self, snapshot):
-        """Applies a complete game state snapshot (from network or save file)."""
+    def _blank_grid(self):
+        """Returns an empty grid_width x grid_height grid (columns built by list repetition, not per-cell comprehension)."""
+        height = self.grid_height
+        return [[None] * height for _ in range(self.grid_width)]
+
+    def apply_full_snapshot(self, snapshot, snapshot_id=None):
+        """Applies a complete game state snapshot (from network or save file); snapshot_id becomes the delta baseline."""
         # Avoid applying state on server/SP mode from external source typically
         # But allow for save game loading which calls this internally
         # if self.network_mode == "sp" or self.network_mode == "host": return
 
         print("DEBUG: Applying full snapshot...") # Add more detailed logging if needed
 
-        # --- Apply Basic State ---
-        self.resources = snapshot.get('resources', self.resources)
+        self._apply_section_basics(snapshot)
+        self.snapshot_id = snapshot_id
+
+        # --- Apply Sections (in order: terrain, players, structures, enemies, projectiles) ---
+        # Terrain only if not already populated, or when loading a save file explicitly
+        is_loading_from_save = 'game_mode_for_save' in snapshot # Only save files carry this key (see save_game_state)
+        if not self.base_terrain or is_loading_from_save:
+            self._apply_section_terrain(snapshot.get('base_terrain'))
+        # All entity dicts are updated in place: stale ids are deleted, the rest updated or inserted
+        try: # One handler for every section instead of one per entity
+            self._apply_section_players(snapshot.get('players', {}))
+            self._apply_section_structures(snapshot.get('structures', {}))
+            # Ensure core HP matches snapshot explicitly (apply_state might be overridden)
+            if self.core:
+                 self.core.hp = snapshot.get('core_hp', self.core.hp)
+                 self.core.max_hp = snapshot.get('core_max_hp', self.core.max_hp)
+            self._apply_section_enemies(snapshot.get('enemies', {}))
+            self._apply_section_projectiles(snapshot.get('projectiles', {}))
+        except SnapshotApplyError as e:
+            print(f"ERROR applying snapshot, waiting for next full state to resync: {e}")
+            self.snapshot_id = None # Partially applied: deltas can't build on it
+        # --- End Sections ---
+
+        print("DEBUG: Finished applying full snapshot.")
+
+    def apply_snapshot_delta(self, delta):
+        """Applies a state_delta from the server (see diff_snapshot): only changed values and removed ids."""
+        self._apply_section_basics(delta)
+        try:
+            players_delta = delta.get('players')
+            if players_delta:
+                self._apply_section_players(players_delta['changed'], prune=False)
+                for pid in players_delta['removed']: self.players.pop(int(pid), None) # Ids arrive as JSON strings
+            structures_delta = delta.get('structures')
+            if structures_delta:
+                self._apply_section_structures(structures_delta['changed'], prune=False)
+                self._h_structures_remove({'ids': structures_delta['removed']})
+            if self.core and 'core_hp' in delta: self.core.hp = delta['core_hp']
+            if self.core and 'core_max_hp' in delta: self.core.max_hp = delta['core_max_hp']
+            enemies_delta = delta.get('enemies')
+            if enemies_delta:
+                self._apply_section_enemies(enemies_delta['changed'], prune=False)
+                self._h_enemies_remove({'ids': enemies_delta['removed']})
+            projectiles_delta = delta.get('projectiles')
+            if projectiles_delta:
+                self._apply_section_projectiles(projectiles_delta['changed'], prune=False)
+                self._h_projectiles_remove({'ids': projectiles_delta['removed']})
+        except SnapshotApplyError as e:
+            print(f"ERROR applying snapshot delta, waiting for next full state to resync: {e}")
+            self.snapshot_id = None
+
+    def _apply_section_basics(self, snapshot):
+        """Applies the top-level values (resources, wave, game status, id counters); keys missing from snapshot are kept."""
+        received_resources = snapshot.get('resources')
+        if isinstance(received_resources, dict) and received_resources is not self.resources: # Same dict when loading a save
+            self.resources.clear(); self.resources.update(received_resources)
         self.wave_number = snapshot.get('wave_number', self.wave_number)
         self.wave_timer = snapshot.get('wave_timer', self.wave_timer)
         self.in_wave = snapshot.get('in_wave', self.in_wave)
@@ -2945,133 +3250,117 @@ class Game:
         # Apply next IDs if loading from save
         self.next_enemy_id = snapshot.get('next_enemy_id', self.next_enemy_id)
         self.next_projectile_id = snapshot.get('next_projectile_id', self.next_projectile_id)
-        # --- End Basic State ---
 
-        # --- Apply Base Terrain (Only if not already populated) ---
-        # Check if base_terrain dict is empty OR if loading from a save file explicitly
-        is_loading_from_save = 'game_mode_for_save' in snapshot # Check if it's a save file snapshot
-        if not self.base_terrain or is_loading_from_save:
-            received_terrain_str = snapshot.get('base_terrain')
-            if received_terrain_str:
-                new_base_terrain = {}
-                new_grid = [[None for _ in range(self.grid_height)] for _ in range(self.grid_width)] # Start with fresh grid
-                try:
-                    for str_key, res_type in received_terrain_str.items():
-                        parts = str_key.split(',')
-                        gx, gy = int(parts[0]), int(parts[1])
-                        new_base_terrain[(gx, gy)] = res_type
-                        # Place visual patch on the new grid
-                        if 0 <= gx < self.grid_width and 0 <= gy < self.grid_height:
-                            new_grid[gx][gy] = ResourcePatch(gx, gy, res_type)
-                    self.base_terrain = new_base_terrain
-                    self.grid = new_grid # Replace old grid
-                    print(f"Applied base terrain ({len(self.base_terrain)} patches).")
-                except Exception as e:
-                    print(f"ERROR parsing base_terrain from snapshot: {e}")
-                    # Keep existing terrain/grid if parsing failed severely? Or clear them?
-                    self.base_terrain = {}
-                    self.grid = [[None for _ in range(self.grid_height)] for _ in range(self.grid_width)]
-            else:
-                 # If no terrain in snapshot, ensure local state is clear
-                 self.base_terrain = {}
-                 self.grid = [[None for _ in range(self.grid_height)] for _ in range(self.grid_width)]
-        # --- End Base Terrain ---
+    def _apply_section_terrain(self, received_terrain):
+        """Rebuilds base_terrain and the grid (with ResourcePatch visuals) from a snapshot terrain section."""
+        self._terrain_snapshot = None # Terrain is replaced below, rebuild the cached list on next snapshot
+        if received_terrain:
+            new_grid = self._blank_grid() # Start with fresh grid
+            try:
+                # [gx, gy, res] triples arrive with native int coords; only older saves ({"gx,gy": res}) need str parsing
+                if isinstance(received_terrain, dict):
+                    new_base_terrain = {tuple(map(int, str_key.split(','))): res_type for str_key, res_type in received_terrain.items()}
+                else:
+                    new_base_terrain = {(gx, gy): res_type for gx, gy, res_type in received_terrain}
+                # Place visual patches on the new grid
+                grid_w, grid_h = self.grid_width, self.grid_height
+                for (gx, gy), res_type in new_base_terrain.items():
+                    if 0 <= gx < grid_w and 0 <= gy < grid_h:
+                        new_grid[gx][gy] = ResourcePatch(gx, gy, res_type)
+                self.base_terrain = new_base_terrain
+                self.grid = new_grid # Replace old grid
+                print(f"Applied base terrain ({len(self.base_terrain)} patches).")
+            except Exception as e:
+                print(f"ERROR parsing base_terrain from snapshot: {e}")
+                # Keep existing terrain/grid if parsing failed severely? Or clear them?
+                self.base_terrain = {}
+                self.grid = self._blank_grid()
+        else:
+             # If no terrain in snapshot, ensure local state is clear
+             self.base_terrain = {}
+             self.grid = self._blank_grid()
 
+    def _apply_section_players(self, received_players, prune=True):
+        """Syncs self.players with a snapshot players section (keyed by stringified player id); prune drops players not in it."""
+        players = self.players # Locals: resolved once instead of per entity
+        received_player_ids = self._scratch_player_ids # Keys arrive as strings, so the int ids are collected while parsing
+        received_player_ids.clear()
 
-        # --- Sync Players ---
-        received_players = snapshot.get('players', {})
-        current_player_ids = set(self.players.keys())
-        received_player_ids = set()
-        new_player_dict = {} # Build the new dictionary incrementally
+        pid_str = None
+        try:
+            for pid_str, player_data in received_players.items():
+                pid = int(pid_str)
+                received_player_ids.add(pid)
+                player = players.get(pid)
+                if player is not None:
+                    # Update existing player
+                    player.apply_state(player_data)
+                else:
+                    # Create new player
+                    # Use data from snapshot, provide defaults if keys missing
+                    start_x = player_data.get('x', self.map_width_px / 2)
+                    start_y = player_data.get('y', self.map_height_px / 2)
+                    name = player_data.get('name', f"Player{pid}")
+                    color_idx = player_data.get('color_idx', pid % len(COLOR_PLAYER_OPTIONS))
+                    new_player = Player(start_x, start_y, pid, name=name, color_index=color_idx)
+                    players[pid] = new_player
+                    print(f"Created player {pid} ('{new_player.name}') from snapshot.")
+        except Exception as e:
+            raise SnapshotApplyError(f"player '{pid_str}': {e}") from e
 
-        for pid_str, player_data in received_players.items():
-             try:
-                 pid = int(pid_str)
-                 received_player_ids.add(pid)
-                 if pid in self.players:
-                     # Update existing player
-                     self.players[pid].apply_state(player_data)
-                     new_player_dict[pid] = self.players[pid] # Keep updated player
-                 else:
-                     # Create new player
-                     # Use data from snapshot, provide defaults if keys missing
-                     start_x = player_data.get('x', self.map_width_px / 2)
-                     start_y = player_data.get('y', self.map_height_px / 2)
-                     name = player_data.get('name', f"Player{pid}")
-                     color_idx = player_data.get('color_idx', pid % len(COLOR_PLAYER_OPTIONS))
-                     new_player = Player(start_x, start_y, pid, name=name, color_index=color_idx)
-                     new_player_dict[pid] = new_player
-                     print(f"Created player {pid} ('{new_player.name}') from snapshot.")
-             except (ValueError, TypeError) as e:
-                 print(f"Error processing player data for key '{pid_str}': {e}")
-                 continue # Skip this player
-
-        # Identify players to remove (present locally but not in snapshot)
-        ids_to_remove = current_player_ids - received_player_ids
+        # Remove players present locally but not in snapshot
+        if not prune: return
+        ids_to_remove = players.keys() - received_player_ids
         if ids_to_remove:
              print(f"Players removed (not in snapshot): {ids_to_remove}")
+             for pid in ids_to_remove: del players[pid]
 
-        self.players = new_player_dict # Replace player dictionary
-        # --- End Sync Players ---
-
-
-        # --- Sync Structures ---
-        received_structures = snapshot.get('structures', {})
-        current_structure_ids = set(self.structures.keys())
-        received_structure_ids = set(received_structures.keys())
-        new_structure_dict = {} # Build the new dictionary
-
+    def _apply_section_structures(self, received_structures, prune=True):
+        """Syncs self.structures, the core and the grid with a snapshot structures section; prune drops structures not in it."""
+        structures, building_info_get = self.structures, self.building_info.get # Locals: resolved once instead of per entity
         core_data_from_snapshot = None
         core_id_from_snapshot = None
 
-        for sid, struct_data in received_structures.items():
-            building_type = struct_data.get('type')
-            if building_type == BUILDING_CORE:
-                # Handle core separately after main loop
-                core_data_from_snapshot = struct_data
-                core_id_from_snapshot = sid
-                continue # Skip adding core to new_structure_dict here
-
-            if sid in self.structures:
-                # Update existing structure
-                try:
-                    self.structures[sid].apply_state(struct_data)
-                    new_structure_dict[sid] = self.structures[sid] # Keep updated structure
-                    # Update grid reference as well
-                    gx, gy = self.structures[sid].grid_x, self.structures[sid].grid_y
-                    if 0 <= gx < self.grid_width and 0 <= gy < self.grid_height:
-                         self.grid[gx][gy] = self.structures[sid]
-                except Exception as e:
-                     print(f"Error applying state to structure {sid}: {e}")
-            else:
-                # Create new structure
-                gx, gy = struct_data.get('gx'), struct_data.get('gy')
-                info = self.building_info.get(building_type)
-                if info and gx is not None and gy is not None:
-                    BuildingClass = info['class']
-                    orientation = struct_data.get('orientation', EAST) if building_type == BUILDING_CONVEYOR else None
-                    try:
+        sid = None
+        try:
+            for sid, struct_data in received_structures.items():
+                building_type = struct_data.get('type')
+                if building_type == BUILDING_CORE:
+                    # Handle core separately after main loop
+                    core_data_from_snapshot = struct_data
+                    core_id_from_snapshot = sid
+                    continue
+
+                struct = structures.get(sid)
+                if struct is not None:
+                    # Update existing structure (grid written in one pass below), unless nothing changed since last apply
+                    if struct.synced_state == struct_data: continue
+                    struct.apply_state(struct_data)
+                    struct.synced_state = struct_data
+                else:
+                    # Create new structure
+                    gx, gy = struct_data.get('gx'), struct_data.get('gy')
+                    info = building_info_get(building_type)
+                    if info and gx is not None and gy is not None:
+                        BuildingClass = info['class']
+                        orientation = struct_data.get('orientation', EAST) if building_type == BUILDING_CONVEYOR else None
                         new_struct = BuildingClass(gx, gy, orientation) if orientation is not None else BuildingClass(gx, gy)
                         new_struct.network_id = sid # Assign the ID from the snapshot
                         new_struct.apply_state(struct_data) # Apply the rest of the state
-                        new_structure_dict[sid] = new_struct
-                        # Place on grid, potentially overwriting ResourcePatch visual
-                        if 0 <= gx < self.grid_width and 0 <= gy < self.grid_height:
-                            self.grid[gx][gy] = new_struct
+                        new_struct.synced_state = struct_data
+                        structures[sid] = new_struct # Placed on grid in one pass below
                         # print(f"DEBUG: Created structure {sid} ({BuildingClass.__name__}) from snapshot.")
-                    except Exception as e:
-                        print(f"ERROR creating structure {sid} (type {building_type}) from snapshot: {e}")
-                else:
-                    print(f"WARN: Invalid data or missing info for new structure {sid} (type {building_type}). Skipping.")
+                    else:
+                        print(f"WARN: Invalid data or missing info for new structure {sid} (type {building_type}). Skipping.")
+        except Exception as e:
+            raise SnapshotApplyError(f"structure {sid}: {e}") from e
 
         # --- Core Handling ---
         if core_data_from_snapshot:
             if self.core and self.core.network_id == core_id_from_snapshot:
                  # Update existing core
                  self.core.apply_state(core_data_from_snapshot)
-                 new_structure_dict[core_id_from_snapshot] = self.core # Add to new dict
-                 gx, gy = self.core.grid_x, self.core.grid_y
-                 if 0 <= gx < self.grid_width and 0 <= gy < self.grid_height: self.grid[gx][gy] = self.core # Ensure grid ref
+                 structures[core_id_from_snapshot] = self.core
                  # print("DEBUG: Updated existing core from snapshot.")
             else:
                  # Create new core if missing or ID doesn't match
@@ -3081,245 +3370,256 @@ class Game:
                       self.core = Core(gx, gy)
                       self.core.network_id = core_id_from_snapshot
                       self.core.apply_state(core_data_from_snapshot)
-                      new_structure_dict[core_id_from_snapshot] = self.core # Add to new dict
-                      if 0 <= gx < self.grid_width and 0 <= gy < self.grid_height: self.grid[gx][gy] = self.core # Place on grid
+                      structures[core_id_from_snapshot] = self.core
                       print("Created Core from snapshot.")
                  else: print("ERROR: Core data in snapshot missing coordinates.")
-        elif self.core:
+        elif self.core and prune:
              # Core exists locally but not in snapshot - remove local core
              print("WARN: Core missing from snapshot, removing local core.")
-             gx, gy = self.core.grid_x, self.core.grid_y
-             if 0 <= gx < self.grid_width and 0 <= gy < self.grid_height and self.grid[gx][gy] == self.core:
-                  base_type = self.base_terrain.get((gx, gy))
-                  self.grid[gx][gy] = ResourcePatch(gx, gy, base_type) if base_type else None
+             self._clear_structure_cell(self.core)
              self.core = None
 
-        # Identify structures to remove
-        struct_ids_to_remove = current_structure_ids - received_structure_ids
-        # Make sure not to remove the current core if it wasn't in the received dict but still exists
-        if self.core and self.core.network_id in struct_ids_to_remove:
-             struct_ids_to_remove.remove(self.core.network_id)
+        if prune:
+            # Remove structures not in the snapshot
+            struct_ids_to_remove = structures.keys() - received_structures.keys() # Key views: no set() copies
+            # Make sure not to remove the current core if it wasn't in the received dict but still exists
+            if self.core: struct_ids_to_remove.discard(self.core.network_id)
 
-        if struct_ids_to_remove:
-            # print(f"DEBUG: Structures removed (not in snapshot): {struct_ids_to_remove}")
             for sid in struct_ids_to_remove:
                  # Ensure grid is cleared where structure was removed
-                 if sid in self.structures: # Get coords from old dict before replacing
-                      old_struct = self.structures[sid]
-                      gx, gy = old_struct.grid_x, old_struct.grid_y
-                      if 0 <= gx < self.grid_width and 0 <= gy < self.grid_height and self.grid[gx][gy] == old_struct:
-                           base_type = self.base_terrain.get((gx, gy))
-                           self.grid[gx][gy] = ResourcePatch(gx, gy, base_type) if base_type else None
+                 self._clear_structure_cell(structures.pop(sid))
+
+        # Single grid pass after removals: place every current structure (overwrites ResourcePatch visuals)
+        # A partial (delta) section only needs its own structures placed
+        grid, grid_w, grid_h = self.grid, self.grid_width, self.grid_height
+        placed = structures.values() if prune else [structures[sid] for sid in received_structures if sid in structures]
+        for struct in placed:
+            gx, gy = struct.grid_x, struct.grid_y
+            if 0 <= gx < grid_w and 0 <= gy < grid_h and grid[gx][gy] is not struct:
+                grid[gx][gy] = struct
+
+    def _apply_section_enemies(self, received_enemies, prune=True):
+        """Syncs self.enemies with a snapshot enemies section; prune drops enemies not in it."""
+        enemies = self.enemies
+        # Target coords don't strictly matter for client/load, use placeholder
+        target_coords = (self.map_width_px/2, self.map_height_px/2)
+        if prune:
+            for eid in enemies.keys() - received_enemies.keys(): del enemies[eid]
+
+        eid = None
+        try:
+            for eid, enemy_data in received_enemies.items():
+                enemy = enemies.get(eid)
+                if enemy is not None:
+                    # Update existing enemy, unless nothing changed since last apply (e.g. stationary while attacking)
+                    if enemy.synced_state == enemy_data: continue
+                    enemy.apply_state(enemy_data); enemy.synced_state = enemy_data
+                else:
+                    # Create new enemy
+                    # Provide defaults for constructor if data is minimal
+                    pos_x = enemy_data.get('x', 0)
+                    pos_y = enemy_data.get('y', 0)
+                    hp = enemy_data.get('hp', ENEMY_START_HP)
+                    new_enemy = Enemy(pos_x, pos_y, target_coords, hp, ENEMY_SPEED, ENEMY_DAMAGE, ENEMY_ATTACK_COOLDOWN, eid)
+                    new_enemy.apply_state(enemy_data) # Apply full state after creation
+                    new_enemy.synced_state = enemy_data
+                    enemies[eid] = new_enemy
+        except Exception as e:
+            raise SnapshotApplyError(f"enemy {eid}: {e}") from e
 
-        self.structures = new_structure_dict # Replace structure dictionary
+    def _apply_section_projectiles(self, received_projectiles, prune=True):
+        """Syncs self.projectiles with a snapshot projectiles section; prune drops projectiles not in it."""
+        projectiles = self.projectiles
+        if prune:
+            for pid in projectiles.keys() - received_projectiles.keys(): del projectiles[pid]
 
-        # Ensure core HP matches snapshot explicitly (apply_state might be overridden)
-        if self.core:
-             self.core.hp = snapshot.get('core_hp', self.core.hp)
-             self.core.max_hp = snapshot.get('core_max_hp', self.core.max_hp)
-        # --- End Sync Structures ---
+        pid = None
+        try:
+            for pid, proj_data in received_projectiles.items():
+                proj = projectiles.get(pid)
+                if proj is not None:
+                    # Update existing projectile
+                    proj.apply_state(proj_data)
+                else:
+                    # Create new projectile
+                    px, py = proj_data.get('x'), proj_data.get('y')
+                    vx, vy = proj_data.get('vx'), proj_data.get('vy')
+                    if px is not None and py is not None and vx is not None and vy is not None:
+                        # Target obj is None when creating from state, provide velocity directly
+                        # Constructor already sets every synced field, so no apply_state pass is needed
+                        projectiles[pid] = Projectile(px, py, None, PROJECTILE_SPEED, 0, pid, vx=vx, vy=vy)
+                    else: print(f"WARN: Invalid projectile data in snapshot for {pid}. Skipping.")
+        except Exception as e:
+            raise SnapshotApplyError(f"projectile {pid}: {e}") from e
 
 
-        # --- Sync Enemies ---
-        received_enemies = snapshot.get('enemies', {})
-        current_enemy_ids = set(self.enemies.keys())
-        received_enemy_ids = set(received_enemies.keys())
-        new_enemy_dict = {}
+    def _build_update_handlers(self):
+        """Maps incremental update message types to their handler methods (see apply_incremental_update)."""
+        return {
+            'player_join': self._h_player_join,
+            'player_leave': self._h_player_leave,
+            'assign_id': self._h_assign_id,
+            'game_status': self._h_game_status,
+            'resource_update': self._h_resource_update,
+            'wave_update': self._h_wave_update,
+            'structure_add': self._h_structure_add,
+            'structure_update': self._h_structure_update,
+            'structure_remove': self._h_structures_remove, # Single id ('net_id') or list ('ids'), see _update_ids
+            'structures_remove': self._h_structures_remove,
+            'enemy_add': self._h_enemy_add,
+            'enemies_remove': self._h_enemies_remove,
+            'projectile_add': self._h_projectile_add,
+            'projectiles_remove': self._h_projectiles_remove,
+            'state_delta': self._h_state_delta,
+            # Add more incremental update types as needed (e.g., player position, structure HP only)
+        }
 
-        for eid, enemy_data in received_enemies.items():
-            if eid in self.enemies:
-                 # Update existing enemy
-                 try:
-                      self.enemies[eid].apply_state(enemy_data)
-                      new_enemy_dict[eid] = self.enemies[eid]
-                 except Exception as e: print(f"Error applying state to enemy {eid}: {e}")
-            else:
-                 # Create new enemy
-                 try:
-                      # Provide defaults for constructor if data is minimal
-                      pos_x = enemy_data.get('x', 0)
-                      pos_y = enemy_data.get('y', 0)
-                      hp = enemy_data.get('hp', ENEMY_START_HP)
-                      # Target coords don't strictly matter for client/load, use placeholder
-                      target_coords = (self.map_width_px/2, self.map_height_px/2)
-                      new_enemy = Enemy(pos_x, pos_y, target_coords, hp, ENEMY_SPEED, ENEMY_DAMAGE, ENEMY_ATTACK_COOLDOWN, eid)
-                      new_enemy.apply_state(enemy_data) # Apply full state after creation
-                      new_enemy_dict[eid] = new_enemy
-                 except Exception as e: print(f"ERROR creating enemy {eid} from snapshot: {e}")
-
-        self.enemies = new_enemy_dict # Replace enemy dictionary
-        # --- End Sync Enemies ---
-
-
-        # --- Sync Projectiles ---
-        received_projectiles = snapshot.get('projectiles', {})
-        current_projectile_ids = set(self.projectiles.keys())
-        received_projectile_ids = set(received_projectiles.keys())
-        new_projectile_dict = {}
-
-        for pid, proj_data in received_projectiles.items():
-             if pid in self.projectiles:
-                  # Update existing projectile
-                  try:
-                       self.projectiles[pid].apply_state(proj_data)
-                       new_projectile_dict[pid] = self.projectiles[pid]
-                  except Exception as e: print(f"Error applying state to projectile {pid}: {e}")
-             else:
-                  # Create new projectile
-                  px, py = proj_data.get('x'), proj_data.get('y')
-                  vx, vy = proj_data.get('vx'), proj_data.get('vy')
-                  if px is not None and py is not None and vx is not None and vy is not None:
-                       try:
-                            # Target obj is None when creating from state, provide velocity directly
-                            new_proj = Projectile(px, py, None, PROJECTILE_SPEED, 0, pid, vx=vx, vy=vy)
-                            # No apply_state needed if constructor takes all values, but call if exists for consistency
-                            if hasattr(new_proj, 'apply_state'): new_proj.apply_state(proj_data)
-                            new_projectile_dict[pid] = new_proj
-                       except Exception as e: print(f"ERROR creating projectile {pid} from snapshot: {e}")
-                  else: print(f"WARN: Invalid projectile data in snapshot for {pid}. Skipping.")
-
-        self.projectiles = new_projectile_dict # Replace projectile dictionary
-        # --- End Sync Projectiles ---
+    def apply_incremental_update(self, update_data, update_type=None):
+        """Applies smaller, targeted updates received over the network (Client only); pass update_type if already known."""
+        if self.network_mode == "sp" or self.network_mode == "host": return # Only clients process these
 
-        print("DEBUG: Finished applying full snapshot.")
+        if update_type is None: update_type = update_data.get('type')
+        handler = self._update_handlers.get(update_type) # One hashed lookup instead of an elif chain
+        if handler is None: return
 
+        try: # Wrap processing in a try-except block for safety
+            handler(update_data)
+        except Exception as e:
+             print(f"ERROR applying incremental update (type: {update_type}): {e}")
+             # Consider requesting full state sync from server on error?
 
-    def apply_incremental_update(self, update_data):
-        """Applies smaller, targeted updates received over the network (Client only)."""
-        if self.network_mode == "sp" or self.network_mode == "host": return # Only clients process these
+    def _h_state_delta(self, update_data): # Changed entities and removed ids since the snapshot with id 'base'
+        data = update_data.get('data')
+        if not isinstance(data, dict): return
+        if self.snapshot_id is None or update_data.get('base') != self.snapshot_id: return # Not our baseline: wait for a full state
+        self.apply_snapshot_delta(data)
+        if self.snapshot_id is not None: self.snapshot_id = update_data.get('id')
 
-        update_type = update_data.get('type')
+    def _h_player_join(self, update_data):
+        data = update_data.get('data')
+        pid = data.get('id')
+        if pid is not None and pid not in self.players:
+            # Create new player based on join data
+            new_p = Player(data['x'], data['y'], pid, data['name'], data['color_idx'])
+            self.players[pid] = new_p
+            print(f"CLIENT: Player {pid} ('{new_p.name}') joined.")
+        elif pid == self.local_player_id and not self.players.get(pid):
+            # Recreate local player if missing (e.g., after some error)
+            self.players[pid] = Player(data['x'], data['y'], pid, data['name'], data['color_idx'])
+
+    def _h_player_leave(self, update_data):
+        pid = update_data.get('player_id')
+        if pid is not None and pid in self.players:
+            print(f"CLIENT: Player {pid} left.")
+            del self.players[pid]
+
+    def _h_assign_id(self, update_data): # Server assigns client its ID
+        assigned_id = update_data.get('data').get('id')
+        if assigned_id is not None:
+             self.local_player_id = assigned_id
+             print(f"CLIENT: Assigned Player ID: {self.local_player_id}")
+             # Ensure player object exists after assignment
+             if self.local_player_id not in self.players:
+                  # Need initial pos/name/color - maybe request full state again?
+                  # Or server should send player data with assign_id
+                  print(f"WARN: Player object for assigned ID {self.local_player_id} not found.")
+
+    def _h_game_status(self, update_data): # Game over/win
+        status = update_data.get('status')
+        self.game_over = (status == 'over')
+        self.game_won = (status == 'won')
+        if self.game_over: print("CLIENT: Received Game Over status.")
+        if self.game_won: print("CLIENT: Received Game Won status.")
+
+    def _h_resource_update(self, update_data): # Full resource dict update
         data = update_data.get('data')
-        net_id = update_data.get('net_id') # For single item removal/update
-        ids = update_data.get('ids')       # For batch removal
+        if isinstance(data, dict): # Replace contents in place so held references stay valid
+            self.resources.clear(); self.resources.update(data)
 
-        try: # Wrap processing in a try-except block for safety
-            if update_type == 'player_join':
-                pid = data.get('id')
-                if pid is not None and pid not in self.players:
-                    # Create new player based on join data
-                    new_p = Player(data['x'], data['y'], pid, data['name'], data['color_idx'])
-                    self.players[pid] = new_p
-                    print(f"CLIENT: Player {pid} ('{new_p.name}') joined.")
-                elif pid == self.local_player_id and not self.players.get(pid):
-                    # Recreate local player if missing (e.g., after some error)
-                    self.players[pid] = Player(data['x'], data['y'], pid, data['name'], data['color_idx'])
-
-            elif update_type == 'player_leave':
-                pid = update_data.get('player_id')
-                if pid is not None and pid in self.players:
-                    print(f"CLIENT: Player {pid} left.")
-                    del self.players[pid]
-
-            elif update_type == 'assign_id': # Server assigns client its ID
-                assigned_id = data.get('id')
-                if assigned_id is not None:
-                     self.local_player_id = assigned_id
-                     print(f"CLIENT: Assigned Player ID: {self.local_player_id}")
-                     # Ensure player object exists after assignment
-                     if self.local_player_id not in self.players:
-                          # Need initial pos/name/color - maybe request full state again?
-                          # Or server should send player data with assign_id
-                          print(f"WARN: Player object for assigned ID {self.local_player_id} not found.")
-
-
-            elif update_type == 'game_status': # Game over/win
-                status = update_data.get('status')
-                self.game_over = (status == 'over')
-                self.game_won = (status == 'won')
-                if self.game_over: print("CLIENT: Received Game Over status.")
-                if self.game_won: print("CLIENT: Received Game Won status.")
-
-            elif update_type == 'resource_update': # Full resource dict update
-                if isinstance(data, dict): self.resources = data
-
-            elif update_type == 'wave_update': # Wave number, timer, status
-                 if isinstance(data, dict):
-                      self.wave_number = data.get('number', self.wave_number)
-                      self.wave_timer = data.get('timer', self.wave_timer)
-                      self.in_wave = data.get('in_wave', self.in_wave)
-
-            elif update_type == 'structure_add': # Add a single new structure
-                 sid = data.get('net_id')
-                 b_type = data.get('type')
-                 gx, gy = data.get('gx'), data.get('gy')
-                 info = self.building_info.get(b_type)
-                 if sid and info and gx is not None and gy is not None and sid not in self.structures:
-                     BuildingClass = info['class']
-                     orient = data.get('orientation', EAST) if b_type == BUILDING_CONVEYOR else None
-                     new_s = BuildingClass(gx, gy, orient) if orient is not None else BuildingClass(gx, gy)
-                     new_s.network_id = sid
-                     new_s.apply_state(data) # Apply full state from message
-                     self.structures[sid] = new_s
-                     # Place on grid
-                     if 0 <= gx < self.grid_width and 0 <= gy < self.grid_height: self.grid[gx][gy] = new_s
-                     if b_type == BUILDING_CORE: self.core = new_s # Assign core ref
-
-            elif update_type == 'structure_update': # Update state of existing structure
-                 sid = data.get('net_id')
-                 if sid in self.structures:
-                     self.structures[sid].apply_state(data)
-                     # Also update core ref if it's the core being updated
-                     if self.core and sid == self.core.network_id: self.core.apply_state(data)
-
-            elif update_type == 'structure_remove': # Remove single structure by ID
-                 if net_id and net_id in self.structures:
-                     s = self.structures[net_id]
-                     gx, gy = s.grid_x, s.grid_y
-                     del self.structures[net_id]
-                     # Clear grid cell or restore resource patch visual
-                     if 0 <= gx < self.grid_width and 0 <= gy < self.grid_height and self.grid[gx][gy] == s:
-                          base_type = self.base_terrain.get((gx, gy))
-                          self.grid[gx][gy] = ResourcePatch(gx, gy, base_type) if base_type else None
-                     if self.core and net_id == self.core.network_id: self.core = None # Clear core ref
-
-            elif update_type == 'structures_remove': # Remove multiple structures by ID list
-                 if ids and isinstance(ids, list):
-                     for sid in ids:
-                         if sid in self.structures:
-                             s = self.structures[sid]; gx, gy = s.grid_x, s.grid_y
-                             del self.structures[sid]
-                             if 0 <= gx < self.grid_width and 0 <= gy < self.grid_height and self.grid[gx][gy] == s:
-                                  base_type = self.base_terrain.get((gx, gy))
-                                  self.grid[gx][gy] = ResourcePatch(gx, gy, base_type) if base_type else None
-                             if self.core and sid == self.core.network_id: self.core = None
-
-            elif update_type == 'enemy_add': # Add single enemy
-                eid = data.get('net_id')
-                if eid and eid not in self.enemies:
-                    target_coords = (self.map_width_px/2, self.map_height_px/2) # Placeholder target
-                    new_e = Enemy(data['x'], data['y'], target_coords, data['hp'], ENEMY_SPEED, ENEMY_DAMAGE, ENEMY_ATTACK_COOLDOWN, eid)
-                    new_e.apply_state(data)
-                    self.enemies[eid] = new_e
-
-            elif update_type == 'enemies_remove': # Remove multiple enemies by ID list
-                if ids and isinstance(ids, list):
-                    for eid in ids:
-                        if eid in self.enemies: del self.enemies[eid]
-
-            elif update_type == 'projectile_add': # Add single projectile
-                 pid = data.get('net_id')
-                 if pid and pid not in self.projectiles:
-                     px, py, vx, vy = data.get('x'), data.get('y'), data.get('vx'), data.get('vy')
-                     if px is not None and py is not None and vx is not None and vy is not None:
-                         new_p = Projectile(px, py, None, PROJECTILE_SPEED, 0, pid, vx=vx, vy=vy)
-                         self.projectiles[pid] = new_p
-
-            elif update_type == 'projectiles_remove': # Remove multiple projectiles by ID list
-                 if ids and isinstance(ids, list):
-                     for pid in ids:
-                         if pid in self.projectiles: del self.projectiles[pid]
+    def _h_wave_update(self, update_data): # Wave number, timer, status
+        data = update_data.get('data')
+        if isinstance(data, dict):
+             self.wave_number = data.get('number', self.wave_number)
+             self.wave_timer = data.get('timer', self.wave_timer)
+             self.in_wave = data.get('in_wave', self.in_wave)
 
-            # Add more incremental update types as needed (e.g., player position, structure HP only)
+    def _h_structure_add(self, update_data): # Add a single new structure
+        data = update_data.get('data')
+        sid = data.get('net_id')
+        b_type = data.get('type')
+        gx, gy = data.get('gx'), data.get('gy')
+        info = self.building_info.get(b_type)
+        if sid and info and gx is not None and gy is not None and sid not in self.structures:
+            BuildingClass = info['class']
+            orient = data.get('orientation', EAST) if b_type == BUILDING_CONVEYOR else None
+            new_s = BuildingClass(gx, gy, orient) if orient is not None else BuildingClass(gx, gy)
+            new_s.network_id = sid
+            new_s.apply_state(data) # Apply full state from message
+            new_s.synced_state = data
+            self.structures[sid] = new_s
+            # Place on grid
+            if 0 <= gx < self.grid_width and 0 <= gy < self.grid_height: self.grid[gx][gy] = new_s
+            if b_type == BUILDING_CORE: self.core = new_s # Assign core ref
+
+    def _h_structure_update(self, update_data): # Update state of existing structure
+        data = update_data.get('data')
+        struct = self.structures.get(data.get('net_id')) # One lookup instead of three
+        if struct is not None:
+            struct.apply_state(data)
+            struct.synced_state = data # Full state, so it is the new comparison baseline
+            # Also update core ref if it's the core being updated (normally the same object, already updated)
+            core = self.core
+            if core is not None and core is not struct and core.network_id == struct.network_id: core.apply_state(data)
+
+    def _update_ids(self, update_data):
+        """Normalizes a remove message to a sequence of ids: a single 'net_id' or an 'ids' list."""
+        net_id = update_data.get('net_id')
+        if net_id: return (net_id,)
+        ids = update_data.get('ids')
+        return ids if isinstance(ids, list) else ()
+
+    def _h_structures_remove(self, update_data): # Remove one or more structures by ID
+        pop_structure, clear_cell = self.structures.pop, self._clear_structure_cell
+        for sid in self._update_ids(update_data):
+            s = pop_structure(sid, None)
+            if s is None: continue
+            clear_cell(s) # Clear grid cell or restore resource patch visual
+            if s is self.core: self.core = None # Clear core ref
+
+    def _h_enemy_add(self, update_data): # Add single enemy
+        data = update_data.get('data')
+        eid = data.get('net_id')
+        if eid and eid not in self.enemies:
+            target_coords = (self.map_width_px/2, self.map_height_px/2) # Placeholder target
+            new_e = Enemy(data['x'], data['y'], target_coords, data['hp'], ENEMY_SPEED, ENEMY_DAMAGE, ENEMY_ATTACK_COOLDOWN, eid)
+            new_e.apply_state(data)
+            new_e.synced_state = data
+            self.enemies[eid] = new_e
+
+    def _h_enemies_remove(self, update_data): # Remove one or more enemies by ID
+        pop_enemy = self.enemies.pop
+        for eid in self._update_ids(update_data): pop_enemy(eid, None)
+
+    def _h_projectile_add(self, update_data): # Add single projectile
+        data = update_data.get('data')
+        pid = data.get('net_id')
+        if pid and pid not in self.projectiles:
+            px, py, vx, vy = data.get('x'), data.get('y'), data.get('vx'), data.get('vy')
+            if px is not None and py is not None and vx is not None and vy is not None:
+                new_p = Projectile(px, py, None, PROJECTILE_SPEED, 0, pid, vx=vx, vy=vy)
+                self.projectiles[pid] = new_p
 
-        except Exception as e:
-             print(f"ERROR applying incremental update (type: {update_type}): {e}")
-             # Consider requesting full state sync from server on error?
+    def _h_projectiles_remove(self, update_data): # Remove one or more projectiles by ID
+        pop_projectile = self.projectiles.pop
+        for pid in self._update_ids(update_data): pop_projectile(pid, None)
 
 
     # --- Music Control Methods ---
     def _setup_music_controls_ui(self):
-        """Calculates the positions for music control buttons and volume slider."""
+        """Calculates the positions for music control buttons and volume slider (existing rects are reused in place)."""
+        def place(rect, x, y, w, h):
+            if rect is None: return pygame.Rect(x, y, w, h)
+            rect.update(x, y, w, h); return rect
         try:
             screen_w = self.screen.get_width()
             btn_size = 28
@@ -3334,20 +3634,20 @@ class Game:
             slider_y = 10
             slider_x = screen_w - margin - slider_width
 
-            self.volume_slider_track_rect = pygame.Rect(slider_x, slider_y, slider_width, slider_height)
+            self.volume_slider_track_rect = place(self.volume_slider_track_rect, slider_x, slider_y, slider_width, slider_height)
             handle_center_x = slider_x + int(self.current_volume * slider_width)
             handle_y = slider_y + (slider_height / 2) - (handle_height / 2)
-            self.volume_slider_handle_rect = pygame.Rect(0, handle_y, handle_width, handle_height)
+            self.volume_slider_handle_rect = place(self.volume_slider_handle_rect, 0, handle_y, handle_width, handle_height)
             self.volume_slider_handle_rect.centerx = handle_center_x
 
             # Button Positioning (relative to slider)
             buttons_y = slider_y + slider_height + slider_bottom_margin
             buttons_x_start = screen_w - margin - (btn_size * 3 + margin * 2)
 
-            self.prev_button_rect = pygame.Rect(buttons_x_start, buttons_y, btn_size, btn_size)
-            self.play_pause_button_rect = pygame.Rect(buttons_x_start + btn_size + margin, buttons_y, btn_size, btn_size)
-            self.next_button_rect = pygame.Rect(buttons_x_start + (btn_size + margin) * 2, buttons_y, btn_size, btn_size)
-        except Exception as e:
+            self.prev_button_rect = place(self.prev_button_rect, buttons_x_start, buttons_y, btn_size, btn_size)
+            self.play_pause_button_rect = place(self.play_pause_button_rect, buttons_x_start + btn_size + margin, buttons_y, btn_size, btn_size)
+            self.next_button_rect = place(self.next_button_rect, buttons_x_start + (btn_size + margin) * 2, buttons_y, btn_size, btn_size)
+        except (pygame.error, AttributeError) as e: # e.g. no display surface yet
              print(f"Error setting up music controls UI: {e}")
              self.volume_slider_track_rect = None
              self.volume_slider_handle_rect = None
@@ -3361,7 +3661,7 @@ class Game:
         if not self.game_music_files or not (0 <= index < len(self.game_music_files)):
             print("WARN: Invalid song index or no music files.")
             self.current_song_index = -1
-            self.music_playing = False
+            self._music_state = MUSIC_STOPPED
             try: pygame.mixer.music.stop()
             except pygame.error: pass
             return
@@ -3369,15 +3669,15 @@ class Game:
         self.current_song_index = index
         song_path = self.game_music_files[self.current_song_index]
         try:
-            print(f"MUSIC: Loading '{os.path.basename(song_path)}'")
+            print(f"MUSIC: Loading '{self.game_music_basenames[index]}'")
             pygame.mixer.music.load(song_path)
             pygame.mixer.music.set_volume(self.current_volume) # Ensure volume is set before playing
             pygame.mixer.music.play(0) # Play once
             pygame.mixer.music.set_endevent(MUSIC_END_EVENT)
-            self.music_playing = True
+            self._music_state = MUSIC_PLAYING
         except pygame.error as e:
             print(f"ERROR: Could not load/play music '{song_path}': {e}")
-            self.music_playing = False
+            self._music_state = MUSIC_STOPPED
             self.current_song_index = -1
 
     def play_next_song(self):
@@ -3399,30 +3699,31 @@ class Game:
              return
 
         try:
-            if pygame.mixer.music.get_busy(): # Is music playing or paused?
-                if self.music_playing: # We think it's playing, so pause it
-                    pygame.mixer.music.pause()
-                    self.music_playing = False
-                    print("MUSIC: Paused")
-                else: # We think it's paused, so unpause it
-                    pygame.mixer.music.unpause()
-                    self.music_playing = True
-                    print("MUSIC: Unpaused")
-            else: # Music is not busy (stopped or never started)
+            # Branch on the tracked state: pygame 2's get_busy() is False while paused, so polling it can't tell paused from stopped
+            if self._music_state == MUSIC_PLAYING:
+                pygame.mixer.music.pause()
+                self._music_state = MUSIC_PAUSED
+                print("MUSIC: Paused")
+            elif self._music_state == MUSIC_PAUSED:
+                pygame.mixer.music.unpause()
+                self._music_state = MUSIC_PLAYING
+                print("MUSIC: Unpaused")
+            else: # Stopped or never started
                  print("MUSIC: No song active or finished, starting next song.")
                  # Start the next song (or first if none was selected)
                  self.play_next_song()
 
         except pygame.error as e:
             print(f"ERROR: Music pause/unpause/play error: {e}")
-            # Reset state potentially
-            self.music_playing = pygame.mixer.music.get_busy() and not self.music_playing # Try to resync based on mixer state
+            # Unknown state after an error: fall back to asking the mixer
+            try: self._music_state = MUSIC_PLAYING if pygame.mixer.music.get_busy() else MUSIC_STOPPED
+            except pygame.error: self._music_state = MUSIC_STOPPED
 
     def handle_music_end_event(self):
         """Called from main loop when MUSIC_END_EVENT is received."""
         print("MUSIC: Song finished, playing next.")
         # When a song naturally ends, automatically play the next one
-        self.music_playing = False # Mark as not playing before starting next
+        self._music_state = MUSIC_STOPPED # Mark as not playing before starting next
         self.play_next_song()
     # --- End Music Control ---
 
@@ -3431,26 +3732,45 @@ class Game:
 class Server:
     def __init__(self, host, port):
         self.host = host; self.port = port; self.server_socket = None
-        self.clients = {}; self.sockets_list = []; self.next_player_id = 1
+        self.clients = {}; self.selector = None; self.next_player_id = 1 # selector: listening + client sockets (registered once)
+        self.client_sockets = () # Snapshot of self.clients keys for broadcasts, rebuilt only when clients join or leave
         self.running = False; self.game_lock = threading.Lock()
         self.initial_snapshot = None; self.queued_inputs = deque()
+        self.queued_moves = {} # player_id -> latest 'move' payload; a newer direction replaces any not yet applied
+        self._initial_state_cache = None; self._initial_state_key = None # Encoded initial_state bytes + (tick, player ids) they match
+        self.last_state_sent = None; self.states_since_keyframe = 0 # Latest broadcast snapshot; deltas since the last keyframe
+        self.last_state_id = None # History id of last_state_sent
+        self.state_history = {}; self.next_snapshot_id = 1 # snapshot id -> snapshot (insertion ordered, oldest dropped first)
+        self._initial_state_id = None # History id of the snapshot in _initial_state_cache
         self.game = None # Reference to the Game instance
+        self._message_handlers = {'join_request': self._handle_join, 'input': self._handle_input} # Client msg type -> handler
     def set_game_instance(self, game_instance): self.game = game_instance
     def start(self):
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server_socket.bind((self.host, self.port)); self.server_socket.listen(MAX_PLAYERS)
-            self.server_socket.setblocking(False); self.sockets_list = [self.server_socket]
+            self.server_socket.setblocking(False)
+            self.selector = selectors.DefaultSelector() # epoll/kqueue where available: cost scales with ready sockets, not all
+            self.selector.register(self.server_socket, selectors.EVENT_READ, data='listen')
             self.running = True; print(f"SERVER: Listening on {self.host}:{self.port}")
         except Exception as e: print(f"SERVER: Failed start - {e}"); self.running = False
     def stop(self):
         self.running = False; print("SERVER: Shutting down...")
-        for sock in list(self.clients.keys()): self._disconnect_client(sock, "Server shutdown")
+        # Close every connection directly: all clients go at once, so no per-client player_leave broadcast (O(N^2) sends)
+        if self.selector:
+            for key in list(self.selector.get_map().values()):
+                if key.data == 'listen': continue
+                try: key.fileobj.close()
+                except Exception as e: print(f"SERVER: Error closing client socket: {e}")
+            self.selector.close()
+        if self.game and self.clients:
+            with self.game_lock:
+                for player_info in self.clients.values(): self.game.players.pop(player_info['id'], None)
         if self.server_socket:
             try: self.server_socket.close()
             except Exception as e: print(f"SERVER: Error closing server socket: {e}")
-        self.server_socket = None; self.sockets_list = []; self.clients = {}
+        self.server_socket = None; self.selector = None; self.clients = {}; self.client_sockets = ()
         print("SERVER: Shutdown complete.")
     def _handle_new_connection(self, client_socket, address):
         if len(self.clients) >= MAX_PLAYERS -1: # Account for host player
@@ -3460,92 +3780,185 @@ class Server:
             except Exception: pass
             client_socket.close(); return
         print(f"SERVER: New connection from {address}")
-        client_socket.setblocking(False); self.sockets_list.append(client_socket)
+        client_socket.setblocking(False); configure_game_socket(client_socket)
+        self.selector.register(client_socket, selectors.EVENT_READ, data=MessageReader()) # Per-connection framing state
     def _disconnect_client(self, client_socket, reason=""):
-        if client_socket in self.sockets_list: self.sockets_list.remove(client_socket)
+        try: self.selector.unregister(client_socket)
+        except (KeyError, ValueError, AttributeError): pass # Already unregistered, closed fd, or server stopped
         player_info = self.clients.pop(client_socket, None); pid = player_info['id'] if player_info else None
+        if player_info: self.client_sockets = tuple(self.clients)
         try: client_socket.close()
         except Exception as e: print(f"SERVER: Error closing client socket: {e}")
         if pid is not None:
             print(f"SERVER: Player {pid} disconnected. Reason: {reason}")
             # Remove player from game instance
             if self.game and pid in self.game.players:
-                 with self.game_lock: del self.game.players[pid]
-            self.broadcast_message({'type': 'player_leave', 'player_id': pid}, exclude_socket=None)
+                 with self.game_lock: del self.game.players[pid]; self.game.state_dirty = True
+            self.broadcast_encoded(encode_id_message(PLAYER_LEAVE_TEMPLATE, pid))
         else: print(f"SERVER: Unknown connection closed. Reason: {reason}")
     def _process_client_message(self, client_socket, message):
-        msg_type = message.get('type'); game = self.game
-        if not game: print("SERVER ERROR: Game ref missing!"); self._disconnect_client(client_socket, "Internal server error"); return
-        if msg_type == 'join_request':
-            pname = message.get('name', f"Player{self.next_player_id}")
-            cidx = message.get('color_idx', self.next_player_id % len(COLOR_PLAYER_OPTIONS))
-            pid = self.next_player_id; self.next_player_id += 1
-            self.clients[client_socket] = {'id': pid, 'addr': client_socket.getpeername(), 'name': pname, 'color_idx': cidx}
-            print(f"SERVER: Player {pid} ('{pname}') joining...")
-            start_x, start_y = 0, 0
-            if game.core: start_x, start_y = grid_to_world_center(game.core.grid_x, game.core.grid_y - (1 + pid))
-            else: start_x, start_y = game.map_width_px / 2, game.map_height_px / 2
-            start_x = max(TILE_SIZE, min(start_x, game.map_width_px - TILE_SIZE))
-            start_y = max(TILE_SIZE, min(start_y, game.map_height_px - TILE_SIZE))
-            new_player_obj = Player(start_x, start_y, pid, name=pname, color_index=cidx)
-            with self.game_lock: game.players[pid] = new_player_obj
-            print(f"SERVER: Added Player {pid} to game.")
-            try: # Send ID
-                 id_msg = encode_message({'type': 'assign_id', 'data': {'id': pid}})
-                 if id_msg: client_socket.sendall(id_msg); print(f"SERVER: Sent assign_id ({pid})")
-                 else: raise ValueError("Encode ID failed")
-            except Exception as e: print(f"SERVER: Error sending ID to {pid}: {e}"); self._disconnect_client(client_socket, "Send ID failed"); return
-            fresh_snapshot = None # Generate snapshot AFTER adding player
-            try:
-                with self.game_lock: fresh_snapshot = game.get_full_snapshot()
-                if not fresh_snapshot: raise ValueError("Snapshot gen failed")
-                print(f"SERVER: Generated fresh snapshot")
-            except Exception as e: print(f"SERVER: Error gen snapshot: {e}"); self._disconnect_client(client_socket, "Snapshot gen error"); return
-            try: # Send State
-                state_msg = encode_message({'type': 'initial_state', 'data': fresh_snapshot})
-                if state_msg: client_socket.sendall(state_msg); print(f"SERVER: Sent initial state to {pid}")
-                else: raise ValueError("Encode state failed")
-            except Exception as e: print(f"SERVER: Error sending state to {pid}: {e}"); self._disconnect_client(client_socket, "Send state failed"); return
-            # Inform others
-            new_p_state = fresh_snapshot['players'].get(str(pid)) or fresh_snapshot['players'].get(pid)
-            if new_p_state:
-                 self.broadcast_message({'type': 'player_join', 'data': new_p_state}, exclude_socket=client_socket)
-                 print(f"SERVER: Broadcasted join for {pid}.")
-            else: print(f"CRITICAL WARN: State for new player {pid} not in fresh snapshot!")
-        elif msg_type == 'input':
-            player_info = self.clients.get(client_socket)
-            if player_info: payload = message.get('payload');
-            if payload: self.queued_inputs.append({'player_id': player_info['id'], 'payload': payload})
+        if not self.game: print("SERVER ERROR: Game ref missing!"); self._disconnect_client(client_socket, "Internal server error"); return
+        msg_type = message.get('type')
+        handler = self._message_handlers.get(msg_type) # One hashed lookup instead of an elif chain
+        if handler: handler(client_socket, message)
         else: print(f"SERVER: Unknown msg type '{msg_type}'")
+    def _handle_join(self, client_socket, message):
+        game = self.game
+        pname = message.get('name', f"Player{self.next_player_id}")
+        cidx = message.get('color_idx', self.next_player_id % len(COLOR_PLAYER_OPTIONS))
+        pid = self.next_player_id; self.next_player_id += 1
+        self.clients[client_socket] = {'id': pid, 'addr': client_socket.getpeername(), 'name': pname, 'color_idx': cidx,
+                                       'sendq': deque(), 'queued_bytes': 0, 'write_armed': False, # Outbound buffers, flushed by update()
+                                       'base_id': None} # Id of the last snapshot queued to this client (its delta baseline)
+        self.client_sockets = tuple(self.clients)
+        print(f"SERVER: Player {pid} ('{pname}') joining...")
+        start_x, start_y = 0, 0
+        if game.core: start_x, start_y = grid_to_world_center(game.core.grid_x, game.core.grid_y - (1 + pid))
+        else: start_x, start_y = game.map_width_px / 2, game.map_height_px / 2
+        start_x = max(TILE_SIZE, min(start_x, game.map_width_px - TILE_SIZE))
+        start_y = max(TILE_SIZE, min(start_y, game.map_height_px - TILE_SIZE))
+        new_player_obj = Player(start_x, start_y, pid, name=pname, color_index=cidx)
+        with self.game_lock: game.players[pid] = new_player_obj; game.state_dirty = True
+        print(f"SERVER: Added Player {pid} to game.")
+        # Send ID
+        if not self._queue_send(client_socket, encode_id_message(ASSIGN_ID_TEMPLATE, pid)): return
+        print(f"SERVER: Sent assign_id ({pid})")
+        state_msg = None # Generated AFTER adding player
+        try:
+            state_msg = self._get_cached_initial_state_bytes()
+            if not state_msg: raise ValueError("Snapshot gen/encode failed")
+        except Exception as e: print(f"SERVER: Error gen snapshot: {e}"); self._disconnect_client(client_socket, "Snapshot gen error"); return
+        # Send State (queued: a large snapshot may not fit the socket buffer in one go)
+        if not self._queue_send(client_socket, (state_msg,)): return
+        self.clients[client_socket]['base_id'] = self._initial_state_id
+        print(f"SERVER: Sent initial state to {pid}")
+        # Inform others
+        self.broadcast_message({'type': 'player_join', 'data': new_player_obj.get_state()}, exclude_socket=client_socket)
+        print(f"SERVER: Broadcasted join for {pid}.")
+    def _handle_input(self, client_socket, message):
+        player_info = self.clients.get(client_socket)
+        if player_info is None: return # Input before join_request: no player to apply it to
+        payload = message.get('payload')
+        if not payload: return
+        if payload.get('action') == 'move': self.queued_moves[player_info['id']] = payload # Coalesced: only the last one matters
+        else: self.queued_inputs.append({'player_id': player_info['id'], 'payload': payload}) # Kept in order (upgrades stack)
+    def _get_cached_initial_state_bytes(self):
+        """Returns encoded initial_state bytes, reusing them while the game tick and player set are unchanged."""
+        game = self.game
+        key = (game.tick_count, tuple(game.players))
+        if self._initial_state_cache is None or key != self._initial_state_key:
+            with self.game_lock: refs = game.collect_snapshot_refs() # Only the reference copy holds the lock
+            snapshot = game.serialize_snapshot(refs)
+            self._initial_state_id = self._record_state(snapshot) if snapshot else None
+            self._initial_state_cache = encode_message({'type': 'initial_state', 'id': self._initial_state_id, 'data': snapshot}) if snapshot else None
+            self._initial_state_key = key
+            print(f"SERVER: Generated fresh snapshot")
+        return self._initial_state_cache
     def update(self):
         if not self.running: return
-        try: read_sockets, _, except_sockets = select.select(self.sockets_list, [], self.sockets_list, 0.01)
-        except ValueError: # Handle closed socket error during select
-             valid_sockets = [s for s in self.sockets_list if s and s.fileno() >= 0]
-             closed_sockets = [s for s in self.sockets_list if s not in valid_sockets]
-             self.sockets_list = valid_sockets
-             for sock in closed_sockets: self._disconnect_client(sock, "Invalid socket detected in select")
-             return # Skip this update cycle
-        for notified in read_sockets:
-            if notified == self.server_socket:
+        for key, mask in self.selector.select(timeout=0.01):
+            notified = key.fileobj
+            if notified.fileno() < 0: continue # Closed earlier in this batch (e.g. a failed broadcast)
+            if mask & selectors.EVENT_WRITE: # Socket drained enough to take more queued output
+                info = self.clients.get(notified)
+                if info: self._flush_send_queue(notified, info)
+                if not mask & selectors.EVENT_READ or notified.fileno() < 0: continue
+            if key.data == 'listen':
                 try: client_sock, addr = self.server_socket.accept(); self._handle_new_connection(client_sock, addr)
                 except Exception as e: print(f"SERVER: Error accept connection: {e}")
             else:
                 try:
-                    message = receive_message(notified)
-                    if message is None: self._disconnect_client(notified, "Connection closed")
-                    else: self._process_client_message(notified, message)
+                    reader = key.data
+                    for message in reader.read_from(notified):
+                        self._process_client_message(notified, message)
+                        if notified.fileno() < 0: break # Dropped while processing
+                    if reader.closed and notified.fileno() >= 0: self._disconnect_client(notified, "Connection closed")
                 except (ConnectionResetError, ConnectionAbortedError) as e: self._disconnect_client(notified, f"Connection error: {e}")
                 except Exception as e: print(f"SERVER: Error process client msg: {e}"); self._disconnect_client(notified, f"Processing error: {e}")
-        for notified in except_sockets: self._disconnect_client(notified, "Socket exception")
-    def get_queued_inputs(self): inputs = list(self.queued_inputs); self.queued_inputs.clear(); return inputs
+    def drain_queued_inputs(self, into):
+        """Moves pending client inputs, oldest first, into a caller-owned list that is reused every frame."""
+        into.extend(self.queued_inputs); self.queued_inputs.clear() # Both containers keep their storage
+        if self.queued_moves: # At most one move per player per frame, however many arrived
+            for pid, payload in self.queued_moves.items(): into.append({'player_id': pid, 'payload': payload})
+            self.queued_moves.clear()
+        return into
     def broadcast_message(self, msg_data, exclude_socket=None):
-        msg_bytes = encode_message(msg_data)
-        if not msg_bytes: print("SERVER: Encode broadcast failed."); return
-        for sock in list(self.clients.keys()):
-            if sock != exclude_socket:
-                try: sock.sendall(msg_bytes)
-                except Exception as e: print(f"SERVER: Error broadcast to {self.clients.get(sock,{}).get('id','?')}: {e}"); self._disconnect_client(sock, f"Broadcast error: {e}")
+        if not self.clients: return # Nobody to send to, skip encoding
+        msg_parts = encode_message_parts(msg_data) # Encoded once; the same buffers are queued for every client
+        if not msg_parts: print("SERVER: Encode broadcast failed."); return
+        self.broadcast_encoded(msg_parts, exclude_socket)
+    def broadcast_encoded(self, msg_parts, exclude_socket=None):
+        """Queues already encoded (header, body) buffers for every client except exclude_socket."""
+        for sock in self.client_sockets: # Immutable snapshot: disconnects during the loop rebind it, they don't mutate it
+            if sock != exclude_socket: self._queue_send(sock, msg_parts)
+    def _record_state(self, snapshot):
+        """Stores a snapshot sent to clients under a new id, so later deltas can use it as their baseline."""
+        snapshot_id = self.next_snapshot_id; self.next_snapshot_id += 1
+        history = self.state_history
+        history[snapshot_id] = snapshot
+        if len(history) > STATE_HISTORY_SIZE: del history[next(iter(history))] # Oldest first (dicts keep insertion order)
+        return snapshot_id
+    def broadcast_state(self, snapshot):
+        """Broadcasts game state to each client as a state_delta against its own baseline, or a full state_update.
+
+        Clients are grouped by baseline (normally one group), so each distinct message is diffed and encoded once.
+        A client whose send queue hasn't drained is skipped (newest wins): it gets a delta from its older baseline
+        once it catches up, instead of a backlog of intermediate states.
+        An unchanged snapshot is only sent to clients still behind it. Returns True while any client was shed.
+        """
+        if snapshot == self.last_state_sent: # Nothing new: re-offer the last state to clients that missed it
+            snapshot_id, snapshot, keyframe = self.last_state_id, self.last_state_sent, False
+        else:
+            snapshot_id = self._record_state(snapshot)
+            self.last_state_sent = snapshot; self.last_state_id = snapshot_id
+            keyframe = self.states_since_keyframe >= STATE_KEYFRAME_INTERVAL
+            if keyframe: self.states_since_keyframe = 0
+            else: self.states_since_keyframe += 1
+        groups = {}; shed = False
+        for sock in self.client_sockets:
+            info = self.clients[sock]
+            if info['base_id'] == snapshot_id: continue # Already has this state
+            if info['sendq']: shed = True; continue # Still sending earlier output: shed this state rather than queue behind it
+            groups.setdefault(info['base_id'], []).append(sock)
+        for base_id, socks in groups.items():
+            baseline = None if keyframe else self.state_history.get(base_id) # Evicted or unknown baseline: full state
+            delta = diff_snapshot(baseline, snapshot) if baseline is not None else None
+            if delta is None: msg = {'type': 'state_update', 'id': snapshot_id, 'data': snapshot}
+            else: msg = {'type': 'state_delta', 'id': snapshot_id, 'base': base_id, 'data': delta}
+            msg_parts = encode_message_parts(msg)
+            if not msg_parts: print("SERVER: Encode state broadcast failed."); continue
+            for sock in socks:
+                if self._queue_send(sock, msg_parts): self.clients[sock]['base_id'] = snapshot_id
+        return shed
+    def _queue_send(self, sock, buffers):
+        """Appends buffers to a client's send queue and sends what the socket accepts now. Returns False if the client was dropped."""
+        info = self.clients.get(sock)
+        if info is None: return False
+        sendq = info['sendq']
+        for buf in buffers: sendq.append(memoryview(buf)); info['queued_bytes'] += len(buf)
+        if info['queued_bytes'] > SEND_QUEUE_HIGH_WATER:
+            self._disconnect_client(sock, f"Slow consumer ({info['queued_bytes']} bytes queued)"); return False
+        return self._flush_send_queue(sock, info)
+    def _flush_send_queue(self, sock, info):
+        """Sends queued buffers without blocking; keeps the unsent remainder and arms EVENT_WRITE until it drains."""
+        sendq = info['sendq']
+        try:
+            while sendq:
+                if SOCKET_HAS_SENDMSG: sent = sock.sendmsg(list(islice(sendq, SEND_IOV_MAX)))
+                else: sent = sock.send(sendq[0])
+                info['queued_bytes'] -= sent
+                while sent:
+                    buf = sendq[0]
+                    if sent < len(buf): sendq[0] = buf[sent:]; break # Partial buffer: keep the rest at the front
+                    sent -= len(buf); sendq.popleft()
+        except (BlockingIOError, InterruptedError): pass # Socket buffer full, wait for EVENT_WRITE
+        except Exception as e:
+            print(f"SERVER: Error sending to {info.get('id', '?')}: {e}"); self._disconnect_client(sock, f"Send error: {e}"); return False
+        if bool(sendq) != info['write_armed']: # Only touch the registration when write interest changes
+            info['write_armed'] = bool(sendq)
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE if sendq else selectors.EVENT_READ
+            self.selector.modify(sock, events, data=self.selector.get_key(sock).data)
+        return True
 
 # --- Network Client Class ---
 # (Client class remains the same as previous corrected version)
@@ -3553,18 +3966,24 @@ class Client:
     def __init__(self, host_ip, port, player_settings):
         self.host_ip = host_ip; self.port = port; self.player_settings = player_settings
         self.socket = None; self.connected = False; self.running = False
+        self.selector = None # Holds the single server socket once connected
+        self.reader = None # MessageReader for the server stream
         self.received_messages = deque()
     def connect(self):
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM); self.socket.settimeout(5.0)
             print(f"CLIENT: Connecting to {self.host_ip}:{self.port}..."); self.socket.connect((self.host_ip, self.port))
-            self.socket.setblocking(False); self.connected = True; self.running = True; print(f"CLIENT: Connected!")
+            self.socket.setblocking(False); configure_game_socket(self.socket)
+            self.connected = True; self.running = True; print(f"CLIENT: Connected!")
+            self.selector = selectors.DefaultSelector(); self.selector.register(self.socket, selectors.EVENT_READ)
+            self.reader = MessageReader()
             join_msg = {'type': 'join_request', 'name': self.player_settings.get('name','?'), 'color_idx': self.player_settings.get('color_index',0)}
             self.send_message(join_msg); return True
         except socket.timeout: print(f"CLIENT: Timeout."); self.disconnect(); return False
         except Exception as e: print(f"CLIENT: Connect failed - {e}"); self.disconnect(); return False
     def disconnect(self):
         self.running = False; self.connected = False
+        if self.selector: self.selector.close(); self.selector = None
         if self.socket: print("CLIENT: Disconnecting...")
         try: self.socket.close()
         except Exception as e: print(f"CLIENT: Error closing: {e}")
@@ -3577,19 +3996,15 @@ class Client:
         except Exception as e: print(f"CLIENT: Send error: {e}."); self.disconnect(); return False
     def update(self):
         if not self.running or not self.connected: return
-        while True:
-            try:
-                ready, _, _ = select.select([self.socket], [], [], 0);
-                if not ready: break
-                message = receive_message(self.socket)
-                if message is None: print("CLIENT: Server disconnected."); self.disconnect(); break
-                else: self.received_messages.append(message)
-            except (ConnectionResetError, ConnectionAbortedError): print("CLIENT: Connection lost."); self.disconnect(); break
-            except socket.error as e:
-                 if e.errno != 10035 and e.errno != 11: print(f"CLIENT: Recv error: {e}."); self.disconnect()
-                 break # Break on error or no data
-            except Exception as e: print(f"CLIENT: Unexpected recv error: {e}"); self.disconnect(); break
-    def get_received_messages(self): msgs = list(self.received_messages); self.received_messages.clear(); return msgs
+        try:
+            if not self.selector.select(0): return
+            self.received_messages.extend(self.reader.read_from(self.socket)) # Everything available, including frames split across reads
+            if self.reader.closed: print("CLIENT: Server disconnected."); self.disconnect()
+        except (ConnectionResetError, ConnectionAbortedError): print("CLIENT: Connection lost."); self.disconnect()
+        except socket.error as e:
+             if e.errno != 10035 and e.errno != 11: print(f"CLIENT: Recv error: {e}."); self.disconnect()
+        except Exception as e: print(f"CLIENT: Unexpected recv error: {e}"); self.disconnect()
+    def get_received_messages(self): msgs = self.received_messages; self.received_messages = deque(); return msgs # Swap, no copy
 
 
 # --- Main Menu Class ---
@@ -3604,26 +4019,36 @@ class MainMenu:
         bw, bh = 250, 50
         for text, action, y_off, enabled in button_defs:
             r = pygame.Rect(cx - bw // 2, cy + y_off - bh // 2, bw, bh)
-            self.buttons.append({'rect': r, 'text': text, 'action': action, 'enabled': enabled})
+            self.buttons.append({'rect': r, 'bounds': button_bounds(r), 'text': text, 'action': action, 'enabled': enabled})
+        self._rebuild_text_cache()
+    def _rebuild_text_cache(self):
+        """Pre-renders the static title, button labels and version text; draw() only blits these surfaces."""
+        self._title_surf = render_text(self.title, 80, COLOR_MENU_TITLE)
+        self._ver_surf = render_text("Version: a18", 16, COLOR_GRAY)
+        for btn in self.buttons: btn['text_surf'] = render_text(btn['text'], 30, COLOR_WHITE if btn['enabled'] else COLOR_GRAY)
     def handle_event(self, event):
         self.selected_action = None
         if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-            for btn in self.buttons:
-                if btn['enabled'] and btn['rect'].collidepoint(event.pos): self.selected_action = btn['action']; break
+            btn = button_at(self.buttons, event.pos)
+            if btn and btn['enabled']: self.selected_action = btn['action']
         elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE: self.selected_action = "quit"
+    def handle_events(self, events):
+        """Handles a frame's menu events; stops at the first one that selects an action so later events can't clear it."""
+        for event in events:
+            self.handle_event(event)
+            if self.selected_action: break
     def get_action(self): action = self.selected_action; self.selected_action = None; return action
     def draw(self):
         # REMOVED: self.screen.fill(COLOR_DARK_GRAY) # Main loop handles background fill now
-        cx, ch = self.screen.get_width(), self.screen.get_height()
-        draw_text(self.screen, self.title, 80, cx // 2, ch // 4, COLOR_MENU_TITLE, align="center")
-        mouse_pos = pygame.mouse.get_pos()
+        screen = self.screen; cx, ch = screen.get_width(), screen.get_height()
+        screen.blit(self._title_surf, self._title_surf.get_rect(center=(cx // 2, ch // 4)))
+        hovered = button_at(self.buttons, pygame.mouse.get_pos()) # Single scan per frame
         for btn in self.buttons:
             color = COLOR_MENU_BUTTON_DISABLED if not btn['enabled'] else \
-                    COLOR_MENU_BUTTON_HOVER if btn['rect'].collidepoint(mouse_pos) else COLOR_MENU_BUTTON
-            text_col = COLOR_GRAY if not btn['enabled'] else COLOR_WHITE
-            pygame.draw.rect(self.screen, color, btn['rect']); pygame.draw.rect(self.screen, COLOR_BLACK, btn['rect'], 2)
-            draw_text(self.screen, btn['text'], 30, btn['rect'].centerx, btn['rect'].centery, text_col, align="center")
-        draw_text(self.screen, "Version: a18", 16, cx - 10, ch - 20, COLOR_GRAY, align="bottomright") # Version updated in main loop logic if needed
+                    COLOR_MENU_BUTTON_HOVER if btn is hovered else COLOR_MENU_BUTTON
+            pygame.draw.rect(screen, color, btn['rect']); pygame.draw.rect(screen, COLOR_BLACK, btn['rect'], 2)
+            screen.blit(btn['text_surf'], btn['text_surf'].get_rect(center=btn['rect'].center))
+        screen.blit(self._ver_surf, self._ver_surf.get_rect(bottomright=(cx - 10, ch - 20))) # Version updated in main loop logic if needed
 
 # --- Main Application Loop ---
 def main():
@@ -3644,16 +4069,15 @@ def main():
 
     print(f"Attempting to load configuration from {CONFIG_FILENAME}...")
     try:
-        with open(CONFIG_FILENAME, 'r') as f:
-            loaded_config = json.load(f)
-            # Validate and update app_config with loaded values
-            app_config['name'] = str(loaded_config.get('name', app_config['name'])).strip()[:16]
-            app_config['color_index'] = int(loaded_config.get('color_index', app_config['color_index']))
-            app_config['host_ip'] = str(loaded_config.get('host_ip', app_config['host_ip'])).strip()
-            app_config['resolution_index'] = int(loaded_config.get('resolution_index', app_config['resolution_index']))
-            app_config['network_interval'] = float(loaded_config.get('network_interval', app_config['network_interval']))
-            loaded_volume = max(0.0, min(1.0, float(loaded_config.get('volume', DEFAULT_MUSIC_VOLUME))))
-            print("Configuration loaded successfully.")
+        loaded_config = read_json_file(CONFIG_FILENAME)
+        # Validate and update app_config with loaded values
+        app_config['name'] = str(loaded_config.get('name', app_config['name'])).strip()[:16]
+        app_config['color_index'] = int(loaded_config.get('color_index', app_config['color_index']))
+        app_config['host_ip'] = str(loaded_config.get('host_ip', app_config['host_ip'])).strip()
+        app_config['resolution_index'] = int(loaded_config.get('resolution_index', app_config['resolution_index']))
+        app_config['network_interval'] = float(loaded_config.get('network_interval', app_config['network_interval']))
+        loaded_volume = max(0.0, min(1.0, float(loaded_config.get('volume', DEFAULT_MUSIC_VOLUME))))
+        print("Configuration loaded successfully.")
     except FileNotFoundError:
         print(f"Configuration file '{CONFIG_FILENAME}' not found. Using defaults.")
     except (json.JSONDecodeError, TypeError, ValueError) as e:
@@ -3706,6 +4130,8 @@ def main():
     screen = pygame.display.set_mode((initial_width, initial_height))
     pygame.display.set_caption(GAME_TITLE)
     clock = pygame.time.Clock()
+    # Only queue event types something handles (window, joystick, audio device... events are never read)
+    pygame.event.set_blocked(None); pygame.event.set_allowed(QUEUED_EVENT_TYPES)
     # --- End Screen Init ---
 
     # --- Font Initialization ---
@@ -3731,8 +4157,8 @@ def main():
     STATE_PLAYING_MP_CLIENT = 5
     STATE_SHOW_IP = 6
     STATE_PROMPT_NEW_LOAD = 7
-    # List of states where the actual game world is active (and particles should NOT be drawn)
-    GAMEPLAY_ACTIVE_STATES = [STATE_PLAYING_SP, STATE_HOSTING, STATE_PLAYING_MP_CLIENT]
+    # States where the actual game world is active (and particles should NOT be drawn); frozenset: hashed membership, built once
+    GAMEPLAY_ACTIVE_STATES = frozenset((STATE_PLAYING_SP, STATE_HOSTING, STATE_PLAYING_MP_CLIENT))
     # -----------------------
 
     current_state = STATE_MAIN_MENU
@@ -3754,27 +4180,47 @@ def main():
 
     app_running = True
     current_network_interval = app_config['network_interval']
-    last_network_update_time = 0.0
+    last_network_update_time = 0.0 # time.monotonic() of the last state broadcast
+    last_synced_volume = None # Volume last pushed to the mixer from a game state's slider
+    input_buf = [] # Client inputs drained from the server each hosting frame (see Server.drain_queued_inputs)
     local_ip_address = get_local_ip()
 
     # --- Variables for New/Load Prompt ---
     prompt_mode_target = None # 'sp' or 'host'
     prompt_save_exists = False
     prompt_buttons = []
+    save_exists_cache = {} # game_mode -> bool; refreshed on main menu entry and kept current by save/load
     # ------------------------------------
 
+    # --- Helper Function for Volume Sync ---
+    def sync_volume(game):
+        """Copies a game's slider volume into app_config, calling into the mixer only when the value changed."""
+        nonlocal last_synced_volume
+        volume = app_config['volume'] = game.current_volume
+        if volume != last_synced_volume:
+            try: pygame.mixer.music.set_volume(volume); last_synced_volume = volume
+            except pygame.error: pass
+
     # --- Helper Function for Save/Load ---
+    def save_filename_for(game_mode): return SAVE_FILENAME_SP if game_mode == 'sp' else SAVE_FILENAME_HOST
+
+    def check_save(game_mode):
+        """Returns whether a save file exists for the mode, only stat-ing the file when the cache has no entry."""
+        exists = save_exists_cache.get(game_mode)
+        if exists is None: exists = save_exists_cache[game_mode] = os.path.exists(save_filename_for(game_mode))
+        return exists
+
     def save_game_state(game_mode):
         """Saves the current game instance state to the appropriate file."""
         if not game_instance: return False
-        filename = SAVE_FILENAME_SP if game_mode == 'sp' else SAVE_FILENAME_HOST
+        filename = save_filename_for(game_mode)
         print(f"Attempting to save game state to {filename}...")
         try:
             snapshot = game_instance.get_full_snapshot()
             if snapshot:
                  snapshot['game_mode_for_save'] = game_mode # Ensure mode is saved
-                 with open(filename, 'w') as f:
-                      json.dump(snapshot, f, indent=2)
+                 write_json_file(filename, snapshot)
+                 save_exists_cache[game_mode] = True
                  print("Game state saved successfully.")
                  return True
             else:
@@ -3786,11 +4232,10 @@ def main():
 
     def load_game_state(game_mode):
         """Loads game state from the appropriate file."""
-        filename = SAVE_FILENAME_SP if game_mode == 'sp' else SAVE_FILENAME_HOST
+        filename = save_filename_for(game_mode)
         print(f"Attempting to load game state from {filename}...")
         try:
-            with open(filename, 'r') as f:
-                load_data = json.load(f)
+            load_data = read_json_file(filename)
             loaded_mode = load_data.get('game_mode_for_save')
             if loaded_mode != game_mode:
                  print(f"WARN: Save file mode ({loaded_mode}) doesn't match requested mode ({game_mode}). Aborting load.")
@@ -3799,6 +4244,7 @@ def main():
             return load_data
         except FileNotFoundError:
             print(f"Save file '{filename}' not found.")
+            save_exists_cache[game_mode] = False
             return None
         except (json.JSONDecodeError, TypeError, ValueError, KeyError) as e:
             print(f"Error loading or parsing save file: {e}. Cannot load.")
@@ -3819,17 +4265,24 @@ def main():
     # =================== #
     while app_running:
         dt = min(clock.tick(FPS) / 1000.0, 0.1) # Delta time in seconds
-        events_this_frame = pygame.event.get()
+        events_this_frame = pygame.event.get() # The frame's only fetch (pumps too); every handler below reuses this list
         action = None # Action determined by menu or game state changes
 
         # --- Global Event Processing (Quit, Music End) ---
+        menu_events = [] # Classified in the same pass: menu states only read these, not the whole queue
+        last_motion = None; motion_count = 0
         for event in events_this_frame:
-            if event.type == pygame.QUIT:
+            event_type = event.type
+            if event_type in MENU_EVENT_TYPES: menu_events.append(event)
+            elif event_type == pygame.MOUSEMOTION: last_motion = event; motion_count += 1
+            elif event_type == pygame.QUIT:
                 app_running = False; break
-            if event.type == MUSIC_END_EVENT:
-                if game_instance and current_state in [STATE_PLAYING_SP, STATE_HOSTING, STATE_PLAYING_MP_CLIENT]:
+            elif event_type == MUSIC_END_EVENT:
+                if game_instance and current_state in GAMEPLAY_ACTIVE_STATES:
                     game_instance.handle_music_end_event()
         if not app_running: break
+        if motion_count > 1: # Motion handling reads the current mouse position, so only the latest motion event matters
+            events_this_frame = [e for e in events_this_frame if e.type != pygame.MOUSEMOTION or e is last_motion]
         # --- End Global Events ---
 
         # --- Update Background Particles (if NOT in an active gameplay state) --- # MODIFIED #
@@ -3840,9 +4293,9 @@ def main():
         # --- State Change Music & Volume Logic ---
         if current_state != previous_state:
             print(f"State changed from {previous_state} to {current_state}")
-            is_game_state = current_state in [STATE_PLAYING_SP, STATE_HOSTING, STATE_PLAYING_MP_CLIENT]
+            is_game_state = current_state in GAMEPLAY_ACTIVE_STATES
             was_menu_state = previous_state == STATE_MAIN_MENU
-            was_game_state = previous_state in [STATE_PLAYING_SP, STATE_HOSTING, STATE_PLAYING_MP_CLIENT]
+            was_game_state = previous_state in GAMEPLAY_ACTIVE_STATES
             is_settings_state = current_state == STATE_SETTINGS
 
             # Fade out music if leaving menu (but NOT going to settings) OR leaving game
@@ -3851,6 +4304,9 @@ def main():
                      try: pygame.mixer.music.fadeout(MUSIC_FADE_MS)
                      except pygame.error: pass # Ignore errors during fadeout
 
+            if current_state == STATE_MAIN_MENU: # Revalidate save files once per menu visit, not per click
+                 for mode in ('sp', 'host'): save_exists_cache[mode] = os.path.exists(save_filename_for(mode))
+
             # Play menu music if entering MAIN MENU
             if current_state == STATE_MAIN_MENU and menu_music_loaded:
                  if not pygame.mixer.music.get_busy(): # Start only if not already playing/fading
@@ -3889,15 +4345,14 @@ def main():
         # --- Main Menu ---
         if current_state == STATE_MAIN_MENU:
             main_menu.screen = screen
-            for event in events_this_frame: main_menu.handle_event(event)
+            main_menu.handle_events(menu_events)
             action = main_menu.get_action()
             if action == "quit":
                 app_running = False
             elif action == "play_sp" or action == "host_mp":
                 # Transition to Prompt State
                 prompt_mode_target = 'sp' if action == "play_sp" else 'host'
-                save_file = SAVE_FILENAME_SP if prompt_mode_target == 'sp' else SAVE_FILENAME_HOST
-                prompt_save_exists = os.path.exists(save_file)
+                prompt_save_exists = check_save(prompt_mode_target)
                 current_state = STATE_PROMPT_NEW_LOAD
                 # Setup prompt buttons
                 prompt_buttons = []
@@ -3906,6 +4361,8 @@ def main():
                 if prompt_save_exists:
                      prompt_buttons.append({'rect': pygame.Rect(cx-btn_w//2, cy-btn_h*0.5, btn_w, btn_h), 'text': 'Load Game', 'action': 'load_game'})
                 prompt_buttons.append({'rect': pygame.Rect(cx-btn_w//2, cy+btn_h*0.5+10, btn_w, btn_h), 'text': 'Cancel', 'action': 'cancel_prompt'})
+                for btn in prompt_buttons: # Hit-test bounds and label surface are fixed while the prompt is open
+                     btn['bounds'] = button_bounds(btn['rect']); btn['text_surf'] = get_text_surface(btn['text'], 30, COLOR_WHITE)
             elif action == "join_mp":
                 current_state = STATE_JOINING;
                 target_ip = app_config.get('host_ip', '127.0.0.1')
@@ -3931,10 +4388,10 @@ def main():
         # --- New/Load Prompt ---
         elif current_state == STATE_PROMPT_NEW_LOAD:
             clicked_action = None
-            for event in events_this_frame:
+            for event in menu_events:
                  if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-                      for btn in prompt_buttons:
-                           if btn['rect'].collidepoint(event.pos): clicked_action = btn['action']; break
+                      btn = button_at(prompt_buttons, event.pos)
+                      if btn: clicked_action = btn['action']
                  elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE: clicked_action = 'cancel_prompt'
             if clicked_action:
                  if clicked_action == 'cancel_prompt': current_state = STATE_MAIN_MENU
@@ -3967,7 +4424,7 @@ def main():
         elif current_state == STATE_SETTINGS:
             settings_menu.screen = screen;
             settings_action = None
-            for event in events_this_frame:
+            for event in menu_events:
                 settings_action = settings_menu.handle_event(event)
                 if settings_action == 'back': break
             settings_menu.update(dt)
@@ -3999,7 +4456,7 @@ def main():
         # --- Show IP ---
         elif current_state == STATE_SHOW_IP:
             esc_pressed = False # Only check for ESC to cancel
-            for event in events_this_frame:
+            for event in menu_events:
                  if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE: esc_pressed = True; break
             if esc_pressed:
                  print("Hosting cancelled."); current_state = STATE_MAIN_MENU
@@ -4015,33 +4472,34 @@ def main():
                 if server_instance: server_instance.stop(); server_instance = None
                 game_instance = None; continue
 
-            queued_inputs = server_instance.get_queued_inputs()
+            server_instance.drain_queued_inputs(input_buf)
             host_esc_pressed = False
             with server_instance.game_lock:
-                for net_input in queued_inputs: # Process client inputs
+                for net_input in input_buf: # Process client inputs
                     pid, payload = net_input['player_id'], net_input['payload']
                     act_type, act_data = payload.get('action'), payload.get('data')
                     player = game_instance.players.get(pid)
                     if player: # Apply actions
-                         if act_type == 'move': player.move_x, player.move_y = act_data.get('x',0), act_data.get('y',0)
+                         if act_type == 'move': player.move_x, player.move_y = act_data.get('x',0), act_data.get('y',0); game_instance.state_dirty = True
                          elif act_type == 'place': game_instance.action_place_structure(pid, act_data['type'], act_data['gx'], act_data['gy'], act_data['orient'])
                          elif act_type == 'remove': game_instance.action_remove_structure(pid, act_data['gx'], act_data['gy'])
                          elif act_type == 'upgrade': game_instance.action_upgrade_structure(pid, act_data['gx'], act_data['gy'])
+                input_buf.clear() # Emptied, not reallocated
 
                 game_instance.handle_events(events_this_frame) # Handle host input
                 if not game_instance.running: host_esc_pressed = True # Host pressed ESC
 
                 game_instance.dt = dt; game_instance.update() # Update game simulation
 
-                app_config['volume'] = game_instance.current_volume # Sync volume back
-                try: pygame.mixer.music.set_volume(app_config['volume'])
-                except pygame.error: pass
+                sync_volume(game_instance) # Sync volume back
 
-            current_time = time.time() # Broadcast state periodically
-            if current_time - last_network_update_time >= current_network_interval:
-                last_network_update_time = current_time; snapshot = None
-                with server_instance.game_lock: snapshot = game_instance.get_full_snapshot()
-                if snapshot: server_instance.broadcast_message({'type': 'state_update', 'data': snapshot})
+            current_time = time.monotonic() # Broadcast state periodically (only if someone is listening); immune to clock adjustments
+            if server_instance.clients and game_instance.state_dirty and current_time - last_network_update_time >= current_network_interval:
+                last_network_update_time = current_time
+                with server_instance.game_lock: refs = game_instance.collect_snapshot_refs(); game_instance.state_dirty = False
+                snapshot = game_instance.serialize_snapshot(refs) # Outside the lock: only the reference copy needs it
+                if snapshot and server_instance.broadcast_state(snapshot):
+                    game_instance.state_dirty = True # A shed client still needs the latest state, even if the world goes quiet
 
             if host_esc_pressed: # Handle host leaving
                 save_game_state('host')
@@ -4061,11 +4519,10 @@ def main():
             error_processing = False
             try: # Process server messages
                 for msg in client_instance.get_received_messages():
-                    msg_type, msg_data = msg.get('type'), msg.get('data')
+                    msg_type = msg.get('type')
                     if not msg_type: continue
-                    if msg_type == 'initial_state': game_instance.apply_full_snapshot(msg_data)
-                    elif msg_type == 'state_update': game_instance.apply_full_snapshot(msg_data)
-                    else: game_instance.apply_incremental_update(msg)
+                    if msg_type in FULL_STATE_MESSAGE_TYPES: game_instance.apply_full_snapshot(msg.get('data'), msg.get('id'))
+                    else: game_instance.apply_incremental_update(msg, msg_type) # Type already looked up
             except Exception as e:
                 print(f"CLIENT ERROR processing server msg: {e}"); # import traceback; traceback.print_exc()
                 client_esc_pressed = True; error_processing = True # Force exit
@@ -4074,9 +4531,7 @@ def main():
                 game_instance.handle_events(events_this_frame)
                 if not game_instance.running: client_esc_pressed = True # Client pressed ESC
 
-                app_config['volume'] = game_instance.current_volume # Sync volume back
-                try: pygame.mixer.music.set_volume(app_config['volume'])
-                except pygame.error: pass
+                sync_volume(game_instance) # Sync volume back
 
                 game_instance.dt = dt; game_instance.update() # Client-side updates
 
@@ -4098,9 +4553,7 @@ def main():
 
             game_instance.dt = dt; game_instance.update() # Update game simulation
 
-            app_config['volume'] = game_instance.current_volume # Sync volume back
-            try: pygame.mixer.music.set_volume(app_config['volume'])
-            except pygame.error: pass
+            sync_volume(game_instance) # Sync volume back
 
             if sp_esc_pressed: # Handle player leaving
                 save_game_state('sp')
@@ -4108,47 +4561,52 @@ def main():
 
         # --- End State Machine ---
 
+        in_gameplay = current_state in GAMEPLAY_ACTIVE_STATES # Decided once; the draw phase branches on it first
+        # Menus animate particles every frame, so they always redraw while visible; minimized, nothing needs drawing or presenting
+        if not in_gameplay and not pygame.display.get_active(): continue # clock.tick still caps the loop
+
         # ------------------- #
         # --- DRAWING --- #
         # ------------------- #
-        screen.fill(COLOR_DARK_GRAY) # Default background
+        if not in_gameplay or not game_instance: # Game.draw() fills the whole screen itself
+            screen.fill(COLOR_DARK_GRAY) # Default background
 
         # --- Draw Background Particles (if NOT in an active gameplay state) --- # MODIFIED #
-        if current_state not in GAMEPLAY_ACTIVE_STATES:
+        if not in_gameplay:
             draw_particles(screen, background_particles)
         # ---------------------------------------------------------------------- #
 
-        # --- Draw based on current state ---
-        if current_state == STATE_MAIN_MENU:
+        # --- Draw based on current state (gameplay first: it's where nearly all frames are spent) ---
+        if in_gameplay: # Draw game only if in these states
+            if game_instance:
+                game_instance.draw() # Game draws its own background (grid, etc.)
+            else:
+                # Draw error over particles if active
+                draw_cached_text(screen, "Error: Game not loaded", 30, screen.get_width()//2, screen.get_height()//2, COLOR_RED, "center")
+        elif current_state == STATE_MAIN_MENU:
             if main_menu: main_menu.draw()
         elif current_state == STATE_PROMPT_NEW_LOAD:
             # Prompt draws itself (over particles if active)
             prompt_title = "Singleplayer" if prompt_mode_target == 'sp' else "Host Game"
-            draw_text(screen, prompt_title, 48, screen.get_width()//2, screen.get_height()//3, COLOR_UI_HEADER, align="center")
-            mouse_pos_draw = pygame.mouse.get_pos()
+            draw_cached_text(screen, prompt_title, 48, screen.get_width()//2, screen.get_height()//3, COLOR_UI_HEADER, align="center")
+            hovered_prompt_btn = button_at(prompt_buttons, pygame.mouse.get_pos())
             for btn in prompt_buttons:
-                 color = COLOR_MENU_BUTTON_HOVER if btn['rect'].collidepoint(mouse_pos_draw) else COLOR_MENU_BUTTON
+                 color = COLOR_MENU_BUTTON_HOVER if btn is hovered_prompt_btn else COLOR_MENU_BUTTON
                  pygame.draw.rect(screen, color, btn['rect'])
                  pygame.draw.rect(screen, COLOR_BLACK, btn['rect'], 2)
-                 draw_text(screen, btn['text'], 30, btn['rect'].centerx, btn['rect'].centery, COLOR_WHITE, align="center")
+                 screen.blit(btn['text_surf'], btn['text_surf'].get_rect(center=btn['rect'].center))
         elif current_state == STATE_SETTINGS:
             if settings_menu: settings_menu.draw()
         elif current_state == STATE_SHOW_IP:
              # Draw IP info (over particles if active)
             current_w, current_h = screen.get_width(), screen.get_height()
-            draw_text(screen, f"Hosting on IP: {local_ip_address}", 36, current_w//2, current_h//2 - 40, COLOR_WHITE, align="center")
-            draw_text(screen, f"Port: {DEFAULT_PORT}", 36, current_w//2, current_h//2, COLOR_WHITE, align="center")
-            draw_text(screen, f"Update Interval: {current_network_interval:.3f}s", 24, current_w//2, current_h//2 + 40, COLOR_GRAY, align="center")
-            draw_text(screen, "Waiting for players... Press ESC to cancel", 24, current_w//2, current_h - 50, COLOR_GRAY, align="center")
-        elif current_state in GAMEPLAY_ACTIVE_STATES: # Draw game only if in these states
-            if game_instance:
-                game_instance.draw() # Game draws its own background (grid, etc.)
-            else:
-                # Draw error over particles if active
-                draw_text(screen, "Error: Game not loaded", 30, screen.get_width()//2, screen.get_height()//2, COLOR_RED, "center")
+            draw_cached_text(screen, f"Hosting on IP: {local_ip_address}", 36, current_w//2, current_h//2 - 40, COLOR_WHITE, align="center")
+            draw_cached_text(screen, f"Port: {DEFAULT_PORT}", 36, current_w//2, current_h//2, COLOR_WHITE, align="center")
+            draw_cached_text(screen, f"Update Interval: {current_network_interval:.3f}s", 24, current_w//2, current_h//2 + 40, COLOR_GRAY, align="center")
+            draw_cached_text(screen, "Waiting for players... Press ESC to cancel", 24, current_w//2, current_h - 50, COLOR_GRAY, align="center")
         elif current_state == STATE_JOINING:
             # Draw joining text (over particles if active)
-            draw_text(screen, f"Connecting to {app_config.get('host_ip', '?')}...", 30, screen.get_width()//2, screen.get_height()//2, COLOR_WHITE, "center")
+            draw_cached_text(screen, f"Connecting to {app_config.get('host_ip', '?')}...", 30, screen.get_width()//2, screen.get_height()//2, COLOR_WHITE, "center")
 
         pygame.display.flip() # Update the screen
     # --- End Main Loop ---
@@ -4160,7 +4618,7 @@ def main():
     print("Exiting Application.")
 
     # --- Save Game on Graceful Exit (if in SP/Host state) ---
-    if game_instance and current_state in [STATE_PLAYING_SP, STATE_HOSTING]:
+    if game_instance and current_state in (STATE_PLAYING_SP, STATE_HOSTING):
          save_game_state(game_instance.network_mode)
     # --- End Save Game on Exit ---
 
@@ -4171,7 +4629,7 @@ def main():
         if game_instance: app_config['volume'] = game_instance.current_volume
         elif 'volume' not in app_config: app_config['volume'] = DEFAULT_MUSIC_VOLUME
 
-        with open(CONFIG_FILENAME, 'w') as f: json.dump(app_config, f, indent=4)
+        write_json_file(CONFIG_FILENAME, app_config, indent=4)
         print("Configuration saved successfully.")
     except IOError as e: print(f"ERROR: Could not save configuration file: {e}")
     # --- End Save Config ---